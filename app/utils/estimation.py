@@ -0,0 +1,326 @@
+"""Vectorized MAP estimation of finger locations."""
+
+from collections import namedtuple
+
+import numpy as np
+
+from app.utils import jit
+from config import app_config
+
+
+# Order of the finger classes along the hypothesis axis.
+CLASSES = ('pinky', 'ring', 'middle', 'index', 'thumb')
+
+# Candidates further than this from a class hypothesis are not considered.
+MAX_DISTANCE = 15
+
+# Diagnostics of one round of iterate_map: the largest hypothesis shift in
+# pixels, the match score and the number of classes with an estimate.
+Iteration = namedtuple('Iteration', ['iteration', 'shift', 'score', 'classes'])
+
+
+def class_posteriors(candidates, hypotheses, max_distance=MAX_DISTANCE):
+    """Return the (candidates x classes) matrix of class posteriors."""
+    candidates = np.asarray(candidates, np.float64).reshape(-1, 2)
+    hypotheses = np.asarray(hypotheses, np.float64).reshape(-1, 2)
+
+    # Probability of any given class hypothesis (Prior).
+    py = 1 / len(hypotheses)
+
+    # Probability of any given candidate point.
+    pp = 1 / len(candidates)
+
+    # 1. Find closest points (s < max_distance) to each class hypothesis.
+    delta = candidates[:, np.newaxis, :] - hypotheses[np.newaxis, :, :]
+    distance = np.sqrt(np.einsum('ijk,ijk->ij', delta, delta))
+    closest = distance < max_distance
+
+    # 2. Calculate similarity scores for each of the closest points based on
+    #    Euclidean distance from class hypothesis.
+    similarity = np.where(closest, 1 / (1 + distance), 0)
+
+    # 3. Calculate the total similarity and use it to calculate the
+    #    probability that each point belongs to the class based on their
+    #    similarities. Points that are not among the closest get P = 0.
+    total_sim = similarity.sum(axis=0)
+    pcgy = np.divide(similarity, total_sim, out=np.zeros_like(similarity),
+                     where=total_sim > 0)
+
+    # 4. Calculate class posteriors.
+    return (pcgy * py) / pp
+
+
+def map_assign(posteriors):
+    """Assign each candidate to its MAP class and keep the best per class.
+
+    Returns, for every class, the index of the winning candidate, its
+    posterior and whether the class won any candidate at all.
+    """
+    n, k = posteriors.shape
+
+    # Class with the highest posterior for every candidate (first on ties).
+    labels = np.argmax(posteriors, axis=1)
+    best = posteriors[np.arange(n), labels]
+
+    # First member with the highest posterior within every class.
+    members = labels[:, np.newaxis] == np.arange(k)
+    scores = np.where(members, best[:, np.newaxis], -np.inf)
+    index = np.argmax(scores, axis=0)
+    found = members.any(axis=0)
+    return index, best[index], found
+
+
+def map_estimates(candidates, hypotheses, classes=CLASSES,
+                  max_distance=MAX_DISTANCE):
+    """Return the MAP estimate of every class that won a candidate.
+
+    The result maps class name to a (candidate, posterior) tuple.
+    """
+    candidates = np.asarray(candidates).reshape(-1, 2)
+    posteriors = class_posteriors(candidates, hypotheses, max_distance)
+    return _estimates(candidates, classes, *map_assign(posteriors))
+
+
+def _estimates(candidates, classes, index, posterior, found):
+    estimates = {}
+    for i, y in enumerate(classes):
+        if found[i]:
+            estimates[y] = (candidates[index[i]], float(posterior[i]))
+    return estimates
+
+
+def match_score(posterior, found, n_candidates):
+    """Mean probability P(candidate | class) of the winning candidates.
+
+    Classes without an estimate count as zero, so the score is in [0, 1].
+    """
+    return float(np.sum(posterior[found])) / n_candidates
+
+
+def iterate_map(candidates, hypotheses, max_iterations=None, tolerance=None,
+                classes=CLASSES, max_distance=MAX_DISTANCE):
+    """Iteratively refine the class hypotheses by MAP estimation.
+
+    Every round estimates the classes from the current hypotheses and feeds
+    the estimates back in as the next hypotheses; classes without an
+    estimate keep their hypothesis. Iteration stops once no hypothesis moves
+    by more than tolerance pixels or after max_iterations rounds.
+
+    Returns the estimates of the last round, as from map_estimates, and one
+    Iteration record of diagnostics per round.
+    """
+    if max_iterations is None:
+        max_iterations = app_config.MAP_MAX_ITERATIONS
+    if tolerance is None:
+        tolerance = app_config.MAP_TOLERANCE
+
+    candidates = np.asarray(candidates).reshape(-1, 2)
+    hypotheses = np.array(hypotheses, np.float64).reshape(-1, 2)
+
+    if jit.enabled() and len(candidates) != 0:
+        index, posterior, found, shifts, scores, counts = jit.iterate_map(
+            candidates.astype(np.float64), hypotheses, max_iterations,
+            tolerance, max_distance)
+        diagnostics = [
+            Iteration(i, float(shift), float(score), int(count))
+            for i, (shift, score, count) in enumerate(
+                zip(shifts, scores, counts))
+        ]
+        estimates = _estimates(candidates, classes, index, posterior, found)
+        return estimates, diagnostics
+
+    diagnostics = []
+    for i in range(max(max_iterations, 1)):
+        posteriors = class_posteriors(candidates, hypotheses, max_distance)
+        index, posterior, found = map_assign(posteriors)
+
+        amax = np.where(found[:, np.newaxis], candidates[index], hypotheses)
+        shift = float(np.max(np.hypot(*(amax - hypotheses).T)))
+        score = match_score(posterior, found, len(candidates))
+        diagnostics.append(Iteration(i, shift, score, int(found.sum())))
+
+        hypotheses = amax
+        if shift <= tolerance:
+            break
+
+    estimates = _estimates(candidates, classes, index, posterior, found)
+    return estimates, diagnostics
+
+
+def pad_candidates(candidates):
+    """Stack the candidates of several hands into one padded array.
+
+    Returns the (hands x n x 2) candidates, n being the most candidates of
+    any hand, and the (hands x n) mask of those that are not padding.
+    """
+    candidates = [np.asarray(c).reshape(-1, 2) for c in candidates]
+    n = max([len(c) for c in candidates] or [0])
+    padded = np.zeros((len(candidates), n, 2), np.float64)
+    valid = np.zeros((len(candidates), n), bool)
+    for i, c in enumerate(candidates):
+        padded[i, :len(c)] = c
+        valid[i, :len(c)] = True
+    return padded, valid
+
+
+def stacked_posteriors(candidates, valid, hypotheses,
+                       max_distance=MAX_DISTANCE):
+    """Return the (hands x n x classes) posteriors of padded candidates.
+
+    Every hand is computed as by class_posteriors over its own candidates
+    and hypotheses, the rows of the padding are zero.
+    """
+    py = 1 / hypotheses.shape[1]
+    pp = 1 / valid.sum(axis=1)
+
+    delta = candidates[:, :, np.newaxis, :] - hypotheses[:, np.newaxis, :, :]
+    distance = np.sqrt(np.einsum('hijk,hijk->hij', delta, delta))
+    closest = (distance < max_distance) & valid[:, :, np.newaxis]
+
+    similarity = np.where(closest, 1 / (1 + distance), 0)
+    total_sim = similarity.sum(axis=1)[:, np.newaxis, :]
+    pcgy = np.divide(similarity, total_sim, out=np.zeros_like(similarity),
+                     where=total_sim > 0)
+    return (pcgy * py) / pp[:, np.newaxis, np.newaxis]
+
+
+def stacked_assign(posteriors, valid):
+    """map_assign of every hand of stacked posteriors.
+
+    Returns the (hands x classes) winning candidate indices, posteriors and
+    found flags. Padding never wins a class.
+    """
+    h, n, k = posteriors.shape
+
+    labels = np.argmax(posteriors, axis=2)
+    best = np.take_along_axis(posteriors, labels[..., np.newaxis], 2)[..., 0]
+
+    members = (labels[..., np.newaxis] == np.arange(k)) & \
+        valid[..., np.newaxis]
+    scores = np.where(members, best[..., np.newaxis], -np.inf)
+    index = np.argmax(scores, axis=1)
+    found = members.any(axis=1)
+    return index, np.take_along_axis(best, index, 1), found
+
+
+def iterate_map_batch(candidates, hypotheses, max_iterations=None,
+                      tolerance=None, classes=CLASSES,
+                      max_distance=MAX_DISTANCE):
+    """Run iterate_map for several hands as one batch.
+
+    candidates is a list with the candidates of every hand and hypotheses
+    their (hands x classes x 2) initial hypotheses. The candidates are
+    padded into one array and every round estimates all the hands still
+    moving at once, a hand stops iterating exactly when iterate_map on its
+    own would. With the compiled kernels enabled the padded hands are
+    handed to one kernel call instead, and a single hand runs through
+    iterate_map.
+
+    Returns a list of (estimates, diagnostics) per hand, as from
+    iterate_map.
+    """
+    if max_iterations is None:
+        max_iterations = app_config.MAP_MAX_ITERATIONS
+    if tolerance is None:
+        tolerance = app_config.MAP_TOLERANCE
+
+    candidates = [np.asarray(c).reshape(-1, 2) for c in candidates]
+    hypotheses = np.array(hypotheses, np.float64).reshape(
+        len(candidates), -1, 2)
+    if len(candidates) == 1:
+        return [iterate_map(candidates[0], hypotheses[0], max_iterations,
+                            tolerance, classes, max_distance)]
+
+    padded, valid = pad_candidates(candidates)
+    counts = valid.sum(axis=1)
+    if jit.enabled() and counts.all():
+        index, posterior, found, shifts, scores, sizes, done = \
+            jit.iterate_map_batch(padded, counts, hypotheses, max_iterations,
+                                  tolerance, max_distance)
+        results = []
+        for h, c in enumerate(candidates):
+            diagnostics = [
+                Iteration(i, float(shifts[h, i]), float(scores[h, i]),
+                          int(sizes[h, i]))
+                for i in range(done[h])
+            ]
+            estimates = _estimates(c, classes, index[h], posterior[h],
+                                   found[h])
+            results.append((estimates, diagnostics))
+        return results
+
+    results = [None] * len(candidates)
+    diagnostics = [[] for _ in candidates]
+
+    # Hands still iterating, only they are stacked into the next round.
+    active = np.arange(len(candidates))
+    for i in range(max(max_iterations, 1)):
+        c, v, h = padded[active], valid[active], hypotheses[active]
+        posteriors = stacked_posteriors(c, v, h, max_distance)
+        index, posterior, found = stacked_assign(posteriors, v)
+
+        winners = np.take_along_axis(c, index[..., np.newaxis], 1)
+        amax = np.where(found[..., np.newaxis], winners, h)
+        delta = amax - h
+        shift = np.max(np.hypot(delta[..., 0], delta[..., 1]), axis=1)
+
+        for j, hand in enumerate(active):
+            score = match_score(posterior[j], found[j], int(counts[hand]))
+            diagnostics[hand].append(Iteration(
+                i, float(shift[j]), score, int(found[j].sum())))
+            results[hand] = (index[j], posterior[j], found[j])
+
+        hypotheses[active] = amax
+        active = active[shift > tolerance]
+        if len(active) == 0:
+            break
+
+    return [
+        (_estimates(c, classes, *result), d)
+        for c, result, d in zip(candidates, results, diagnostics)
+    ]
+
+
+class HandEstimate(namedtuple('HandEstimate', [
+        'palm_center', 'palm_height', 'tips', 'posteriors', 'found',
+        'candidates', 'contour', 'circle', 'diagnostics'])):
+    """Fingertip estimates of one hand.
+
+    tips (n x 2), posteriors (n) and found (n) are ordered as CLASSES, the
+    rows of classes without an estimate are zero. candidates are the convex
+    hull points of contour, and circle is the (center, radius) enclosing
+    circle of the contour, or None when the palm was not searched for.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def build(cls, estimates, candidates, contour, palm, diagnostics,
+              classes=CLASSES):
+        """Build an estimate from the results of iterate_map and find_palm."""
+        center, radius, palm_center, palm_height = palm
+
+        tips = np.zeros((len(classes), 2), np.int64)
+        posteriors = np.zeros(len(classes))
+        found = np.zeros(len(classes), bool)
+        for i, y in enumerate(classes):
+            if y in estimates:
+                tips[i], posteriors[i] = estimates[y]
+                found[i] = True
+
+        circle = None if center is None else (center, radius)
+        return cls(palm_center, palm_height, tips, posteriors, found,
+                   candidates, contour, circle, diagnostics)
+
+    @property
+    def palm(self):
+        """The palm as returned by find_palm."""
+        center, radius = self.circle or (None, None)
+        return center, radius, self.palm_center, self.palm_height
+
+    def estimates(self, classes=CLASSES):
+        """Return the estimates as a dict, as from map_estimates."""
+        return {
+            y: (self.tips[i], float(self.posteriors[i]))
+            for i, y in enumerate(classes) if self.found[i]
+        }
@@ -0,0 +1,266 @@
+"""Vectorized geometry of the palmar hand model.
+
+Computes the palm and the tips, bases, lengths and rotated boxes of the
+fingers as NumPy arrays, following the same construction and integer
+rounding as the scalar accessors of HandPalmar. Every function accepts a
+batch of hypotheses: center has shape (..., 2), height (...), and angles
+(..., n) for n fingers, giving tips and bases of shape (..., n, 2), lengths
+(..., n) and boxes (..., n, 4, 2).
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from app.utils import jit
+from config import app_config
+
+
+# Finger indices along the finger axis.
+PINKY, RING, MIDDLE, INDEX, THUMB = range(5)
+FINGERS = (PINKY, RING, MIDDLE, INDEX, THUMB)
+
+# Default angles (radians) and palm to finger ratios of every finger.
+DEFAULT_ANGLES = np.array([
+    -app_config.PINKY_DEFAULT_ANGLE * np.pi / 180,
+    -app_config.RING_DEFAULT_ANGLE * np.pi / 180,
+    -app_config.MIDDLE_DEFAULT_ANGLE * np.pi / 180,
+    -app_config.INDEX_DEFAULT_ANGLE * np.pi / 180,
+    -app_config.THUMB_DEFAULT_ANGLE * np.pi / 180
+])
+
+RATIOS = np.array([
+    app_config.PINKY_DEFAULT_RATIO,
+    app_config.RING_DEFAULT_RATIO,
+    app_config.MIDDLE_DEFAULT_RATIO,
+    app_config.INDEX_DEFAULT_RATIO,
+    app_config.THUMB_DEFAULT_RATIO
+])
+
+# Palm edges the finger lines are intersected with to find the finger base.
+# A finger uses its fallback edge when it does not cross its primary edge.
+TOP, LEFT, RIGHT, NONE = range(4)
+PRIMARY_EDGE = np.array([TOP, TOP, TOP, TOP, RIGHT])
+FALLBACK_EDGE = np.array([LEFT, NONE, NONE, RIGHT, NONE])
+
+# Ratio of palm width to palm height.
+PALM_RATIO = 0.90
+
+
+Palm = namedtuple('Palm', [
+    'peak', 'base', 'width', 'top_left', 'top_right', 'bottom_right',
+    'bottom_left'
+])
+
+HandGeometry = namedtuple('HandGeometry', [
+    'palm', 'tips', 'bases', 'lengths', 'boxes'
+])
+
+
+def _round(a):
+    return np.round(a).astype(np.int64)
+
+
+def _points(x, y):
+    return np.stack(np.broadcast_arrays(x, y), axis=-1)
+
+
+def palm(center, height, ratio=PALM_RATIO):
+    """Return the corners of the palm rectangle."""
+    center = np.asarray(center)
+    height = np.asarray(height)
+
+    cx = np.trunc(center[..., 0]).astype(np.int64)
+    peak_y = _round(center[..., 1] - (height / 2))
+    base_y = _round(center[..., 1] + (height / 2))
+    width = _round(ratio * height)
+
+    left = _round(cx - (width / 2))
+    right = _round(cx + (width / 2))
+
+    return Palm(
+        peak=_points(cx, peak_y),
+        base=_points(cx, base_y),
+        width=width,
+        top_left=_points(left, peak_y),
+        top_right=_points(right, peak_y),
+        bottom_right=_points(right, base_y),
+        bottom_left=_points(left, base_y)
+    )
+
+
+def ccw(a, b, c):
+    return ((c[..., 1] - a[..., 1]) * (b[..., 0] - a[..., 0]) >
+            (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0]))
+
+
+def segments_intersect(a, b, c, d):
+    """Whether the segments ab and cd cross, element-wise."""
+    return ((ccw(a, c, d) != ccw(b, c, d)) &
+            (ccw(a, b, c) != ccw(a, b, d)))
+
+
+def line_intersection(a, b, c, d):
+    """Intersection of the lines through ab and cd, element-wise.
+
+    Parallel lines have no intersection and give NaN.
+    """
+    xdiff0 = a[..., 0] - b[..., 0]
+    xdiff1 = c[..., 0] - d[..., 0]
+    ydiff0 = a[..., 1] - b[..., 1]
+    ydiff1 = c[..., 1] - d[..., 1]
+
+    div = xdiff0 * ydiff1 - xdiff1 * ydiff0
+    d0 = a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0]
+    d1 = c[..., 0] * d[..., 1] - c[..., 1] * d[..., 0]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (d0 * xdiff1 - d1 * xdiff0) / div
+        y = (d0 * ydiff1 - d1 * ydiff0) / div
+    return _points(x, y)
+
+
+def rotate_points(points, origin, theta):
+    """Rotate points around their origin by theta, element-wise."""
+    cos = np.cos(theta)
+    sin = np.sin(theta)
+    dx = points[..., 0] - origin[..., 0]
+    dy = points[..., 1] - origin[..., 1]
+    return _points(
+        cos * dx - sin * dy + origin[..., 0],
+        sin * dx + cos * dy + origin[..., 1]
+    )
+
+
+def finger_tips(center, height, angles=None, fingers=FINGERS):
+    """Return the default hypothesis of the finger tips."""
+    fingers = np.asarray(fingers)
+    if angles is None:
+        angles = DEFAULT_ANGLES[fingers]
+
+    base = palm(center, height).base[..., np.newaxis, :]
+    h = np.asarray(height)[..., np.newaxis]
+    length = RATIOS[fingers] * h
+    return _points(
+        _round(base[..., 0] + (length * np.cos(angles))),
+        _round(base[..., 1] + (length * np.sin(angles)))
+    )
+
+
+def finger_bases(p, tips, fingers=FINGERS):
+    """Return where the lines from the palm base to the tips leave the palm."""
+    fingers = np.asarray(fingers)
+    shape = tips.shape
+
+    def edge(a, b):
+        a = np.broadcast_to(a[..., np.newaxis, :], shape)
+        b = np.broadcast_to(b[..., np.newaxis, :], shape)
+        return a, b
+
+    base = np.broadcast_to(p.base[..., np.newaxis, :], shape)
+    top = edge(p.top_left, p.top_right)
+    left = edge(p.top_left, p.bottom_left)
+    right = edge(p.top_right, p.bottom_right)
+
+    crosses_top = segments_intersect(top[0], top[1], base, tips)
+    crosses_right = segments_intersect(right[0], right[1], base, tips)
+    crossed = {TOP: crosses_top, RIGHT: crosses_right}
+
+    primary = PRIMARY_EDGE[fingers]
+    fallback = FALLBACK_EDGE[fingers]
+    use = np.where(fallback == NONE, primary, fallback)
+    for e in (TOP, RIGHT):
+        use = np.where((primary == e) & crossed[e], e, use)
+
+    points = np.where(
+        (use == TOP)[..., np.newaxis], line_intersection(*top, base, tips),
+        np.where((use == LEFT)[..., np.newaxis],
+                 line_intersection(*left, base, tips),
+                 line_intersection(*right, base, tips)))
+
+    # Finger lines parallel to their edge have no base, use the tip instead.
+    points = np.where(np.isfinite(points), points, tips)
+    return _round(points)
+
+
+def finger_boxes(tips, bases, angles=None, finger_width=app_config.FINGER_WIDTH):
+    """Return the rotated boxes of the fingers and their lengths.
+
+    Boxes are oriented by the given finger angles, or by the direction from
+    base to tip when angles is None.
+    """
+    delta = tips - bases
+    lengths = np.sqrt(delta[..., 0] ** 2 + delta[..., 1] ** 2)
+
+    if angles is None:
+        angles = np.arctan2(delta[..., 1], delta[..., 0])
+
+    bx = bases[..., 0]
+    by = bases[..., 1]
+    top = by - lengths + 2
+    corners = np.stack([
+        _points(bx - finger_width, top),
+        _points(bx + finger_width, top),
+        _points(bx + finger_width, by),
+        _points(bx - finger_width, by)
+    ], axis=-2)
+
+    theta = np.broadcast_to(angles + (90 * np.pi / 180), bx.shape)
+    boxes = rotate_points(corners, bases[..., np.newaxis, :],
+                          theta[..., np.newaxis])
+    return _round(boxes), lengths
+
+
+def _hand_geometry_jit(center, height, angles, amax, fingers, finger_width):
+    # One hand through the compiled kernel, with the arrays hand_geometry
+    # returns.
+    if amax is None:
+        amax = np.empty((0, 2), np.int64)
+    else:
+        amax = np.asarray(amax).astype(np.int64).reshape(-1, 2)
+    cx, peak_y, base_y, width, left, right, tips, bases, lengths, boxes = \
+        jit.hand_geometry(
+            float(center[0]), float(center[1]), float(height),
+            np.broadcast_to(angles, fingers.shape).astype(np.float64),
+            fingers.astype(np.int64), amax, PALM_RATIO, RATIOS,
+            PRIMARY_EDGE, FALLBACK_EDGE, finger_width, 90 * np.pi / 180)
+
+    p = Palm(
+        peak=np.array([cx, peak_y]),
+        base=np.array([cx, base_y]),
+        width=np.int64(width),
+        top_left=np.array([left, peak_y]),
+        top_right=np.array([right, peak_y]),
+        bottom_right=np.array([right, base_y]),
+        bottom_left=np.array([left, base_y])
+    )
+    return HandGeometry(p, tips, bases, lengths, boxes)
+
+
+def hand_geometry(center, height, angles=None, amax=None, fingers=FINGERS,
+                  finger_width=app_config.FINGER_WIDTH):
+    """Compute the palm and all the finger geometry of one or more hands.
+
+    With amax the tips are the given estimates, shape (..., n, 2), and the
+    boxes are oriented along the fingers; otherwise the tips are the default
+    hypotheses for the given angles.
+    """
+    fingers = np.asarray(fingers)
+    if angles is None:
+        angles = DEFAULT_ANGLES[fingers]
+    angles = np.asarray(angles, np.float64)
+
+    if jit.enabled() and np.ndim(center) == 1 and np.ndim(height) == 0:
+        return _hand_geometry_jit(center, height, angles, amax, fingers,
+                                  finger_width)
+
+    p = palm(center, height)
+    if amax is None:
+        tips = finger_tips(center, height, angles, fingers)
+    else:
+        tips = np.asarray(amax).astype(np.int64)
+
+    bases = finger_bases(p, tips, fingers)
+    boxes, lengths = finger_boxes(
+        tips, bases, None if amax is not None else angles, finger_width)
+    return HandGeometry(p, tips, bases, lengths, boxes)
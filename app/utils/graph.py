@@ -0,0 +1,270 @@
+"""Processing stages as a graph that only reruns what a change affects.
+
+Every stage declares the stages it reads and the parameters it depends on.
+Its output is memoized under a key built from the keys of its inputs and
+the values of its parameters, the frame itself being keyed by a hash of
+its pixels. Running a stage first runs its inputs, so after a parameter
+changes only the stages downstream of it compute again: moving the
+threshold reruns the threshold, edges, contour and observation but not
+the HSV conversion and skin detection.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import cv2
+
+from app.utils.processing import (
+    do_edges, do_skin_detection, find_contours, observe_hands,
+    render_estimates, skin_from_hsv, threshold_gray,
+)
+from app.utils.skin import get_skin_lut
+from config import app_config
+
+
+# A stage computes fn(ctx, *input values, **parameters). Its value is what
+# fn returns, and the context buffers it writes that later stages read are
+# listed in buffers so that they can be restored from the memo.
+Stage = namedtuple('Stage', ['name', 'inputs', 'params', 'buffers', 'fn'])
+
+
+def _hsv(ctx):
+    cv2.cvtColor(ctx.og, cv2.COLOR_BGR2HSV, ctx.hsv)
+
+
+def _skin(ctx, hsv, lower, upper, skin_lut):
+    if skin_lut:
+        do_skin_detection(ctx, lut=get_skin_lut(skin_lut))
+    else:
+        skin_from_hsv(ctx, lower, upper)
+
+
+def _gray(ctx, skin):
+    cv2.cvtColor(ctx.skin, cv2.COLOR_BGR2GRAY, ctx.gray)
+
+
+def _threshold(ctx, gray, threshold):
+    threshold_gray(ctx, threshold)
+
+
+def _edges(ctx, thresh):
+    do_edges(ctx)
+
+
+def _contour(ctx, edges, hands):
+    return find_contours(ctx, hands)
+
+
+def _observation(ctx, contours):
+    return observe_hands(ctx, contours)
+
+
+def _render(ctx, estimates):
+    render_estimates(ctx, estimates)
+
+
+class Cancelled(Exception):
+    """Raised by StageGraph.run when it is cancelled between two stages."""
+
+
+# The stages of the pipeline, every one after its inputs.
+STAGES = (
+    Stage('hsv', (), (), ('hsv',), _hsv),
+    Stage('skin', ('hsv',), ('lower', 'upper', 'skin_lut'),
+          ('mask', 'skin'), _skin),
+    Stage('gray', ('skin',), (), ('gray',), _gray),
+    Stage('threshold', ('gray',), ('threshold',), ('thresh',), _threshold),
+    Stage('edges', ('threshold',), (), ('edges',), _edges),
+    Stage('contour', ('edges',), ('hands',), (), _contour),
+    Stage('observation', ('contour',), (), (), _observation),
+    Stage('render', ('observation',), (),
+          ('contours', 'hypothesis', 'estimate'), _render),
+)
+
+
+class StageGraph(object):
+    """Memoized stages run on the buffers of one FrameContext.
+
+    Every stage keeps its last cache_size outputs, its value and copies of
+    its buffers, so switching a parameter back to a recent value restores
+    the outputs instead of computing them. ran lists the stages computed
+    by the last call to run.
+    """
+
+    def __init__(self, ctx, params=None, stages=STAGES, cache_size=None):
+        if cache_size is None:
+            cache_size = app_config.STAGE_CACHE_SIZE
+
+        self.ctx = ctx
+        self.params = dict(params or {})
+        self.stages = OrderedDict((s.name, s) for s in stages)
+        self.cache_size = max(cache_size, 1)
+        self.cache = {name: OrderedDict() for name in self.stages}
+        self.current = {}
+        self.frame_key = None
+        self.ran = []
+        self.cancelled = None
+
+    def load(self, frame):
+        """Load a frame into the context, keyed by a hash of its pixels."""
+        self.ctx.load(frame)
+        self.frame_key = hashlib.sha1(self.ctx.og.tobytes()).hexdigest()
+
+    def set(self, **params):
+        self.params.update(params)
+
+    def run(self, name='observation', cancelled=None):
+        """Return the value of a stage, computing only what changed.
+
+        cancelled is called before every stage that is computed, and the
+        run is abandoned with Cancelled when it returns true. The stages
+        computed so far stay memoized.
+        """
+        self.ran = []
+        self.cancelled = cancelled
+        return self._run(name)[1]
+
+    def _run(self, name):
+        stage = self.stages[name]
+        inputs = [self._run(i) for i in stage.inputs]
+        key = (name, self.frame_key, tuple([k for k, _ in inputs]),
+               tuple([_freeze(self.params.get(p)) for p in stage.params]))
+
+        cache = self.cache[name]
+        if key in cache:
+            cache.move_to_end(key)
+            value, buffers = cache[key]
+            if self.current.get(name) != key:
+                for buf, saved in buffers.items():
+                    self.ctx.get(buf)[...] = saved
+                self.current[name] = key
+            return key, value
+
+        if self.cancelled is not None and self.cancelled():
+            raise Cancelled(name)
+        kwargs = {p: self.params.get(p) for p in stage.params}
+        value = stage.fn(self.ctx, *[v for _, v in inputs], **kwargs)
+        self.ran.append(name)
+
+        # With a single entry the buffers always hold it, no copies needed.
+        buffers = {}
+        if self.cache_size > 1:
+            buffers = {b: self.ctx.get(b).copy() for b in stage.buffers}
+        cache[key] = (value, buffers)
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        self.current[name] = key
+        return key, value
+
+
+class BackgroundGraph(object):
+    """Run a StageGraph on a background thread for the latest parameters.
+
+    schedule records new parameters and returns at once. The worker gathers
+    the changes of debounce seconds from the first one into a single run of
+    the target stage. A run whose parameters change again is abandoned
+    before its next stage. Its finished stages stay memoized and their
+    outputs are published all the same, so while a slider is dragged the
+    early stages keep updating even if the later ones cannot keep up.
+    """
+
+    def __init__(self, graph, target='render', buffers=(), debounce=None):
+        if debounce is None:
+            debounce = app_config.UI_DEBOUNCE_MS / 1000
+
+        self.graph = graph
+        self.target = target
+        self.buffers = buffers
+        self.debounce = debounce
+        self.cond = threading.Condition()
+        self.pending = None
+        self.generation = 0
+        self.changed = 0.0
+        self.published = {}
+        self.result = None
+        self.error = None
+        self.stopped = False
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join()
+
+    def schedule(self, **params):
+        """Run the graph with params soon, superseding older parameters."""
+        with self.cond:
+            if self.pending is None:
+                self.changed = time.monotonic()
+            self.pending = params
+            self.generation += 1
+            self.cond.notify()
+
+    def latest(self):
+        """Return a version number and copies of the published buffers.
+
+        Every buffer holds the last finished output of its stage, the
+        version changes whenever one of them does. Returns None before
+        anything was published.
+        """
+        return self.result
+
+    def _stale(self, generation):
+        return self.stopped or self.generation != generation
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while self.pending is None and not self.stopped:
+                    self.cond.wait()
+                while not self.stopped:
+                    rest = self.changed + self.debounce - time.monotonic()
+                    if rest <= 0:
+                        break
+                    self.cond.wait(rest)
+                if self.stopped:
+                    return
+                params, generation = self.pending, self.generation
+                self.pending = None
+
+            self.graph.set(**params)
+            try:
+                self.graph.run(self.target,
+                               lambda: self._stale(generation))
+                self.error = None
+            except Cancelled:
+                pass
+            except Exception as e:
+                # A stage failed, the stages before it still show. Keep the
+                # worker alive so that the next parameters are run.
+                self.error = e
+            self._publish()
+
+    def _publish(self):
+        buffers = dict(self.result[1]) if self.result else {}
+        changed = False
+        for name, stage in self.graph.stages.items():
+            key = self.graph.current.get(name)
+            if key is None or self.published.get(name) == key:
+                continue
+            for b in stage.buffers:
+                if b in self.buffers:
+                    buffers[b] = self.graph.ctx.get(b).copy()
+                    changed = True
+            self.published[name] = key
+        if changed:
+            version = self.result[0] + 1 if self.result else 0
+            self.result = (version, buffers)
+
+
+def _freeze(value):
+    # Parameters given as lists are hashed as tuples.
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
@@ -1,7 +1,121 @@
 """Implements methods to keep track of changes to the image."""
 
+import hashlib
+import os
+from collections import OrderedDict
 
-image = {}
+import cv2
+import numpy as np
+
+from config import app_config
+
+
+def readImage(path, size=None, cache_dir=None):
+    """Decode an image file, resized to size (width, height) if given.
+
+    With a cache_dir the decoded image is saved there as .npy and later
+    reads memory-map it instead of decoding the file again. Returns None when
+    the file cannot be read, like cv2.imread.
+    """
+    if cache_dir is not None:
+        try:
+            cached = os.path.join(cache_dir, _cacheName(path, size))
+        except OSError:
+            return None
+        if os.path.exists(cached):
+            return np.load(cached, mmap_mode='r')
+
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    if size is not None and img.shape[:2] != (size[1], size[0]):
+        img = cv2.resize(img, (size[0], size[1]))
+
+    if cache_dir is not None:
+        # Write under a temporary name so that concurrent readers never
+        # see a partial file.
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = '{0}.{1}.tmp'.format(cached, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, img)
+        os.replace(tmp, cached)
+    return img
+
+
+def _cacheName(path, size):
+    # The modification time and size of the file invalidate the entry.
+    st = os.stat(path)
+    key = '{0}:{1}:{2}:{3}'.format(
+        os.path.abspath(path), st.st_mtime_ns, st.st_size,
+        None if size is None else tuple(size))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy'
+
+
+class ImageRegistry(object):
+    """Images that are decoded on first access and kept in an LRU cache.
+
+    Images are registered by path and only read when first asked for. At
+    most max_bytes of them are kept, the least recently used are dropped
+    first and read again when needed. Reads go through readImage with the
+    given size and cache_dir. Images set directly have no file to be read
+    from again, so they are never dropped.
+    """
+
+    def __init__(self, paths=None, max_bytes=None, cache_dir=None, size=None):
+        if max_bytes is None:
+            max_bytes = app_config.IMAGE_CACHE_BYTES
+        if cache_dir is None:
+            cache_dir = app_config.IMAGE_CACHE_DIR
+
+        self.paths = dict(paths or {})
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.size = size
+        self.images = OrderedDict()
+        self.pinned = {}
+        self.nbytes = 0
+
+    def register(self, key, path):
+        self._drop(key)
+        self.pinned.pop(key, None)
+        self.paths[key] = path
+
+    def __setitem__(self, key, img):
+        self._drop(key)
+        self.pinned[key] = img
+
+    def __getitem__(self, key):
+        if key in self.pinned:
+            return self.pinned[key]
+        if key in self.images:
+            self.images.move_to_end(key)
+            return self.images[key]
+
+        path = self.paths[key]
+        img = readImage(path, self.size, self.cache_dir)
+        if img is None:
+            raise IOError('cannot read image {0}'.format(path))
+
+        self.images[key] = img
+        self.nbytes += img.nbytes
+        while self.nbytes > self.max_bytes and len(self.images) > 1:
+            self._drop(next(iter(self.images)))
+        return img
+
+    def __contains__(self, key):
+        return key in self.pinned or key in self.paths
+
+    def _drop(self, key):
+        img = self.images.pop(key, None)
+        if img is not None:
+            self.nbytes -= img.nbytes
+
+
+image = ImageRegistry(app_config.IMAGES)
+
+
+def registerImage(key, path):
+    image.register(key, path)
 
 
 def setImage(key, img):
@@ -10,3 +124,81 @@ def setImage(key, img):
 
 def getImage(key):
     return image[key]
+
+
+class FrameContext(object):
+    """Preallocated buffers holding the intermediates of one frame.
+
+    The processing stages write into these buffers through the OpenCV dst
+    arguments, so a context can be reused for every frame of a stream without
+    allocating. Contexts share no state, so frames can be processed
+    concurrently as long as each one has its own context.
+
+    A context for a region of interest, see roi, runs the stages on views of
+    the region only while drawing the overlays over the whole frame.
+    """
+
+    # Names of the single channel buffers.
+    GRAY = ('mask', 'scratch', 'gray', 'thresh', 'blur', 'edges', 'border')
+
+    # Names of the three channel (BGR) buffers.
+    COLOR = ('og', 'hsv', 'skin')
+
+    # Names of the three channel (BGR) overlays drawn over the whole frame.
+    OVERLAY = ('contours', 'hypothesis', 'estimate')
+
+    def __init__(self, width=app_config.IMG_WIDTH,
+                 height=app_config.IMG_HEIHGT):
+        self.width = width
+        self.height = height
+
+        for key in self.GRAY:
+            setattr(self, key, np.zeros((height, width), np.uint8))
+        for key in self.COLOR + self.OVERLAY:
+            setattr(self, key, np.zeros((height, width, 3), np.uint8))
+
+        # Scratch buffer for the skin lookup table indices.
+        self.bgra = np.zeros((height, width, 4), np.uint8)
+
+        # Connected component labels of the edges.
+        self.labels = np.zeros((height, width), np.int32)
+
+        # Per-iteration diagnostics of the last MAP estimation.
+        self.diagnostics = []
+
+        # Whole input frame and the position of og within it.
+        self.frame = self.og
+        self.offset = (0, 0)
+
+    def load(self, img):
+        """Resize an image into the input buffer."""
+        if img.shape[:2] == (self.height, self.width):
+            np.copyto(self.og, img)
+        else:
+            cv2.resize(img, (self.width, self.height), self.og)
+        return self.og
+
+    def get(self, key):
+        return getattr(self, key)
+
+    def roi(self, x, y, width, height):
+        """Return a context for a region of the loaded frame.
+
+        The processing buffers of the returned context are zero-copy views
+        of the region in this context's buffers, the overlays are shared
+        whole, and contours found in it are in whole frame coordinates.
+        """
+        region = (slice(y, y + height), slice(x, x + width))
+
+        ctx = FrameContext.__new__(FrameContext)
+        ctx.width = width
+        ctx.height = height
+        for key in self.GRAY + self.COLOR + ('bgra', 'labels'):
+            setattr(ctx, key, self.get(key)[region])
+        for key in self.OVERLAY:
+            setattr(ctx, key, self.get(key))
+
+        ctx.diagnostics = []
+        ctx.frame = self.frame
+        ctx.offset = (self.offset[0] + x, self.offset[1] + y)
+        return ctx
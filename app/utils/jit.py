@@ -0,0 +1,292 @@
+"""Numba-compiled kernels of the MAP estimation and hand geometry.
+
+estimation.iterate_map and geometry.hand_geometry use these kernels in place
+of their NumPy code when Numba is installed and Config.USE_JIT is set. For
+the few candidates and fingers of a frame, NumPy spends most of its time in
+call overhead, which the kernels avoid. The kernels follow the NumPy code
+operation by operation so that both give identical results.
+"""
+
+import math
+
+import numpy as np
+
+from config import app_config
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def available():
+    """Whether Numba is installed."""
+    return numba is not None
+
+
+def enabled():
+    """Whether the kernels should be used."""
+    return numba is not None and app_config.USE_JIT
+
+
+def _jit(fn):
+    # Without Numba the kernels stay plain Python functions, never called.
+    if numba is None:
+        return fn
+    return numba.njit(cache=True, nogil=True)(fn)
+
+
+@_jit
+def _posteriors(candidates, hypotheses, max_distance, out):
+    n = candidates.shape[0]
+    k = hypotheses.shape[0]
+    py = 1 / k
+    pp = 1 / n
+
+    for j in range(k):
+        total_sim = 0.0
+        for i in range(n):
+            dx = candidates[i, 0] - hypotheses[j, 0]
+            dy = candidates[i, 1] - hypotheses[j, 1]
+            distance = math.sqrt(dx * dx + dy * dy)
+            if distance < max_distance:
+                out[i, j] = 1 / (1 + distance)
+            else:
+                out[i, j] = 0.0
+            total_sim += out[i, j]
+
+        for i in range(n):
+            if total_sim > 0:
+                out[i, j] = ((out[i, j] / total_sim) * py) / pp
+            else:
+                out[i, j] = 0.0
+
+
+@_jit
+def _assign(posteriors, index, posterior, found):
+    n, k = posteriors.shape
+    labels = np.empty(n, np.int64)
+    best = np.empty(n)
+    for i in range(n):
+        labels[i] = 0
+        for j in range(1, k):
+            if posteriors[i, j] > posteriors[i, labels[i]]:
+                labels[i] = j
+        best[i] = posteriors[i, labels[i]]
+
+    for j in range(k):
+        index[j] = 0
+        found[j] = False
+    for i in range(n):
+        j = labels[i]
+        if not found[j] or best[i] > best[index[j]]:
+            index[j] = i
+            found[j] = True
+    for j in range(k):
+        posterior[j] = best[index[j]]
+
+
+@_jit
+def iterate_map(candidates, hypotheses, max_iterations, tolerance,
+                max_distance):
+    """Kernel of estimation.iterate_map.
+
+    Returns the index, posterior and found arrays of the last round, as from
+    map_assign, and the shift, score and class count of every round.
+    """
+    n = candidates.shape[0]
+    k = hypotheses.shape[0]
+    rounds = max(max_iterations, 1)
+
+    hypotheses = hypotheses.copy()
+    posteriors = np.empty((n, k))
+    index = np.zeros(k, np.int64)
+    posterior = np.zeros(k)
+    found = np.zeros(k, np.bool_)
+    shifts = np.empty(rounds)
+    scores = np.empty(rounds)
+    classes = np.empty(rounds, np.int64)
+
+    for r in range(rounds):
+        _posteriors(candidates, hypotheses, max_distance, posteriors)
+        _assign(posteriors, index, posterior, found)
+
+        shift = 0.0
+        total = 0.0
+        count = 0
+        for j in range(k):
+            if found[j]:
+                x = candidates[index[j], 0]
+                y = candidates[index[j], 1]
+                shift = max(shift, math.hypot(x - hypotheses[j, 0],
+                                              y - hypotheses[j, 1]))
+                hypotheses[j, 0] = x
+                hypotheses[j, 1] = y
+                total += posterior[j]
+                count += 1
+
+        shifts[r] = shift
+        scores[r] = total / n
+        classes[r] = count
+        if shift <= tolerance:
+            return (index, posterior, found, shifts[:r + 1], scores[:r + 1],
+                    classes[:r + 1])
+
+    return index, posterior, found, shifts, scores, classes
+
+
+@_jit
+def iterate_map_batch(candidates, counts, hypotheses, max_iterations,
+                      tolerance, max_distance):
+    """Kernel of estimation.iterate_map_batch.
+
+    candidates are padded to (hands x n x 2) and counts holds the number of
+    candidates of every hand. Returns the outputs of iterate_map stacked
+    along a first hands axis, the per round arrays padded to the most
+    rounds, and the number of rounds of every hand.
+    """
+    hands = candidates.shape[0]
+    k = hypotheses.shape[1]
+    rounds = max(max_iterations, 1)
+
+    index = np.zeros((hands, k), np.int64)
+    posterior = np.zeros((hands, k))
+    found = np.zeros((hands, k), np.bool_)
+    shifts = np.zeros((hands, rounds))
+    scores = np.zeros((hands, rounds))
+    classes = np.zeros((hands, rounds), np.int64)
+    done = np.zeros(hands, np.int64)
+
+    for h in range(hands):
+        i, p, f, s, c, y = iterate_map(
+            candidates[h, :counts[h]], hypotheses[h], max_iterations,
+            tolerance, max_distance)
+        index[h] = i
+        posterior[h] = p
+        found[h] = f
+        done[h] = len(s)
+        shifts[h, :done[h]] = s
+        scores[h, :done[h]] = c
+        classes[h, :done[h]] = y
+
+    return index, posterior, found, shifts, scores, classes, done
+
+
+@_jit
+def _ccw(ax, ay, bx, by, cx, cy):
+    return (cy - ay) * (bx - ax) > (by - ay) * (cx - ax)
+
+
+@_jit
+def _crosses(ax, ay, bx, by, cx, cy, dx, dy):
+    return (_ccw(ax, ay, cx, cy, dx, dy) != _ccw(bx, by, cx, cy, dx, dy) and
+            _ccw(ax, ay, bx, by, cx, cy) != _ccw(ax, ay, bx, by, dx, dy))
+
+
+@_jit
+def _intersection(ax, ay, bx, by, cx, cy, dx, dy):
+    # Parallel lines have no intersection, returns ok False.
+    xdiff0 = ax - bx
+    xdiff1 = cx - dx
+    ydiff0 = ay - by
+    ydiff1 = cy - dy
+
+    div = xdiff0 * ydiff1 - xdiff1 * ydiff0
+    if div == 0:
+        return 0.0, 0.0, False
+    d0 = ax * by - ay * bx
+    d1 = cx * dy - cy * dx
+    return (d0 * xdiff1 - d1 * xdiff0) / div, \
+        (d0 * ydiff1 - d1 * ydiff0) / div, True
+
+
+@_jit
+def hand_geometry(cx, cy, height, angles, fingers, amax, ratio, ratios,
+                  primary_edge, fallback_edge, finger_width, right_angle):
+    """Kernel of geometry.hand_geometry for a single hand.
+
+    amax is an (n x 2) array of tips, or has no rows to use the default
+    hypotheses. Returns the palm center x, peak y, base y, width, left x and
+    right x, then the tips, bases, lengths and boxes.
+    """
+    top, left, right, none = 0, 1, 2, 3
+    n = fingers.shape[0]
+
+    # Palm.
+    px = np.int64(math.trunc(cx))
+    peak_y = np.int64(np.rint(cy - (height / 2)))
+    base_y = np.int64(np.rint(cy + (height / 2)))
+    width = np.int64(np.rint(ratio * height))
+    pl = np.int64(np.rint(px - (width / 2)))
+    pr = np.int64(np.rint(px + (width / 2)))
+
+    tips = np.empty((n, 2), np.int64)
+    bases = np.empty((n, 2), np.int64)
+    lengths = np.empty(n)
+    boxes = np.empty((n, 4, 2), np.int64)
+
+    for i in range(n):
+        f = fingers[i]
+        if amax.shape[0] == 0:
+            length = ratios[f] * height
+            tips[i, 0] = np.int64(np.rint(px + (length * math.cos(angles[i]))))
+            tips[i, 1] = np.int64(
+                np.rint(base_y + (length * math.sin(angles[i]))))
+        else:
+            tips[i, 0] = amax[i, 0]
+            tips[i, 1] = amax[i, 1]
+        tx = tips[i, 0]
+        ty = tips[i, 1]
+
+        # Base, where the line from the palm base to the tip leaves the palm.
+        use = fallback_edge[f]
+        if use == none:
+            use = primary_edge[f]
+        if primary_edge[f] == top and _crosses(pl, peak_y, pr, peak_y,
+                                               px, base_y, tx, ty):
+            use = top
+        if primary_edge[f] == right and _crosses(pr, peak_y, pr, base_y,
+                                                 px, base_y, tx, ty):
+            use = right
+
+        if use == top:
+            x, y, ok = _intersection(pl, peak_y, pr, peak_y,
+                                     px, base_y, tx, ty)
+        elif use == left:
+            x, y, ok = _intersection(pl, peak_y, pl, base_y,
+                                     px, base_y, tx, ty)
+        else:
+            x, y, ok = _intersection(pr, peak_y, pr, base_y,
+                                     px, base_y, tx, ty)
+        if not ok:
+            x = tx
+            y = ty
+        bx = np.int64(np.rint(x))
+        by = np.int64(np.rint(y))
+        bases[i, 0] = bx
+        bases[i, 1] = by
+
+        # Box, oriented by the angle or along the finger.
+        ddx = tx - bx
+        ddy = ty - by
+        lengths[i] = math.sqrt(ddx ** 2 + ddy ** 2)
+        if amax.shape[0] == 0:
+            theta = angles[i] + right_angle
+        else:
+            theta = math.atan2(ddy, ddx) + right_angle
+        cos = math.cos(theta)
+        sin = math.sin(theta)
+
+        box_top = by - lengths[i] + 2
+        for c in range(4):
+            if c == 0 or c == 3:
+                x = bx - finger_width
+            else:
+                x = bx + finger_width
+            y = box_top if c < 2 else by
+            dx = x - bx
+            dy = y - by
+            boxes[i, c, 0] = np.int64(np.rint(cos * dx - sin * dy + bx))
+            boxes[i, c, 1] = np.int64(np.rint(sin * dx + cos * dy + by))
+
+    return px, peak_y, base_y, width, pl, pr, tips, bases, lengths, boxes
@@ -0,0 +1,167 @@
+"""Per-stage timing and counters of the pipeline.
+
+Observations are kept in rolling windows, summarized as p50/p95/p99 and
+dumped as JSON or in the Prometheus text format. Recording is off by
+default: a disabled stage costs one flag check.
+"""
+
+import json
+import time
+from functools import wraps
+
+import numpy as np
+
+from config import app_config
+
+
+# Quantiles reported for every histogram.
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram(object):
+    """Rolling window of the last observations of a value.
+
+    The count and sum are kept over all observations, the quantiles only
+    over the window.
+    """
+
+    def __init__(self, window=None):
+        if window is None:
+            window = app_config.METRICS_WINDOW
+        self.values = np.zeros(max(window, 1))
+        self.index = 0
+        self.size = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.values)
+        self.size = min(self.size + 1, len(self.values))
+        self.count += 1
+        self.sum += value
+
+    def window(self):
+        """Return the observations in the window, in no particular order."""
+        return self.values[:self.size]
+
+    def quantiles(self, quantiles=QUANTILES):
+        if self.size == 0:
+            return [float('nan')] * len(quantiles)
+        return np.percentile(
+            self.window(), [q * 100 for q in quantiles]).tolist()
+
+
+class Metrics(object):
+    """Registry of histograms keyed by metric name and labels."""
+
+    def __init__(self, window=None):
+        self.enabled = False
+        self.window = window
+        self.histograms = {}
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        self.histograms = {}
+
+    def histogram(self, name, labels=()):
+        key = (name, tuple(sorted(labels)))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram(self.window)
+        return hist
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, labels.items()).observe(value)
+
+    def timed(self, stage):
+        """Decorate a function to record its wall time as stage_seconds."""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe('stage_seconds',
+                                 time.perf_counter() - start, stage=stage)
+            return wrapper
+        return decorator
+
+    def export(self):
+        """Return and clear the observations since the last export.
+
+        The result is picklable and can be added to another registry with
+        merge, e.g. to collect the metrics of pool workers.
+        """
+        exported = [
+            (key, hist.window().tolist(), hist.count, hist.sum)
+            for key, hist in self.histograms.items()
+        ]
+        self.reset()
+        return exported
+
+    def merge(self, exported):
+        for (name, labels), values, count, total in exported:
+            hist = self.histogram(name, labels)
+            for value in values:
+                hist.observe(value)
+            hist.count += count - len(values)
+            hist.sum += total - sum(values)
+
+    def snapshot(self):
+        """Return the summary of every histogram, sorted by name."""
+        summaries = []
+        for (name, labels), hist in sorted(self.histograms.items()):
+            summary = {
+                'name': name,
+                'labels': dict(labels),
+                'count': hist.count,
+                'sum': hist.sum
+            }
+            for q, v in zip(QUANTILES, hist.quantiles()):
+                summary['p{0:g}'.format(q * 100)] = v
+            summaries.append(summary)
+        return summaries
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def to_prometheus(self, prefix='pral'):
+        """Return the histograms as Prometheus summaries."""
+        lines = []
+        last = None
+        for (name, labels), hist in sorted(self.histograms.items()):
+            metric = '{0}_{1}'.format(prefix, name)
+            if metric != last:
+                lines.append('# TYPE {0} summary'.format(metric))
+                last = metric
+
+            for q, v in zip(QUANTILES, hist.quantiles()):
+                lines.append('{0}{1} {2}'.format(
+                    metric, _labels(labels + (('quantile', q),)), _value(v)))
+            lines.append('{0}_sum{1} {2}'.format(
+                metric, _labels(labels), _value(hist.sum)))
+            lines.append('{0}_count{1} {2}'.format(
+                metric, _labels(labels), hist.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _value(v):
+    return 'NaN' if np.isnan(v) else repr(float(v))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(k, v) for k, v in labels) + '}'
+
+
+# Registry of the pipeline stages.
+metrics = Metrics()
+timed = metrics.timed
@@ -3,40 +3,101 @@
 import cv2
 import numpy as np
 
+from app.utils.geometry import (
+    DEFAULT_ANGLES, HandGeometry, INDEX, MIDDLE, PALM_RATIO, PINKY, RING,
+    THUMB, hand_geometry,
+)
 from app.utils.helper import checklineIntersection, lineIntersection, rotatePoint
 from config import app_config
 
 
-class Hand(object):
-    """Base class for hand models."""
+def _tip(geometry):
+    return tuple(int(v) for v in geometry.tips[0])
+
+
+def _base(geometry):
+    return tuple(int(v) for v in geometry.bases[0])
+
 
-    # Center point of palm.
-    center = [0, 0]
+def _length(geometry):
+    return float(geometry.lengths[0])
 
-    # Height of palm.
-    height = 0
 
-    # Width of palm.
-    width = 0
+def _box(geometry):
+    return [tuple(int(v) for v in p) for p in geometry.boxes[0]]
+
+
+def _frozen(geometry):
+    # Make the arrays of a geometry read-only so that the models sharing it
+    # cannot change it.
+    for a in tuple(geometry.palm) + tuple(geometry[1:]):
+        if isinstance(a, np.ndarray):
+            a.flags.writeable = False
+    return geometry
+
+
+class Hand(object):
+    """Base class for hand models.
+
+    The palm center, height, width and MAP estimates are fixed when a model
+    is built, so every model owns its own state and can be shared between
+    threads.
+    """
+
+    __slots__ = ('_center', '_height', '_width', '_amax')
 
     # Thickness of finger
     finger_width = app_config.FINGER_WIDTH
 
-    # Result of iterative MAP estimation.
-    amax = None
+    # Ratio of palm width to palm height.
+    width_ratio = 0
 
     def __init__(self, center_point, palm_height, amax=None):
-        self.center[0] = center_point[0]
-        self.center[1] = center_point[1]
-        self.height = palm_height
-        self.amax = amax
+        self._center = (center_point[0], center_point[1])
+        self._height = palm_height
+        self._width = round(self.width_ratio * palm_height)
+
+        if amax is not None:
+            amax = tuple(tuple(int(v) for v in p) for p in amax)
+        self._amax = amax
+
+    @property
+    def center(self):
+        """Center point of palm."""
+        return self._center
+
+    @property
+    def height(self):
+        """Height of palm."""
+        return self._height
+
+    @property
+    def width(self):
+        """Width of palm."""
+        return self._width
+
+    @property
+    def amax(self):
+        """Result of iterative MAP estimation."""
+        return self._amax
 
 
 class HandPalmar(Hand):
+    """Palmar hand model.
+
+    The geometry of all five fingers at their default angles, or along the
+    MAP estimates when given, is computed once when the model is built.
+    """
+
+    __slots__ = ('_geometry',)
+
+    width_ratio = PALM_RATIO
 
     def __init__(self, center_point, palm_height, amax=None):
         super().__init__(center_point, palm_height, amax)
-        self.width = round(0.90 * palm_height)
+        self._geometry = _frozen(hand_geometry(
+            self.center, self.height, None, self.amax,
+            finger_width=self.finger_width))
 
     def peak(self):
         return (int(self.center[0]), int(round(self.center[1] - (self.height / 2))))
@@ -56,276 +117,100 @@ class HandPalmar(Hand):
     def bottom_left(self):
         return (int(round(self.base()[0] - (self.width / 2))), int(self.base()[1]))
 
-    def pinky(self, theta):
-        if self.amax is not None:
-            return tuple(self.amax[0])
+    def geometry(self, angles=None):
+        """Compute the geometry of all five fingers at once.
+
+        See app.utils.geometry.hand_geometry.
+        """
+        if angles is None:
+            return self._geometry
+        return hand_geometry(self.center, self.height, angles, self.amax,
+                             finger_width=self.finger_width)
+
+    def finger(self, finger, theta):
+        """Compute the geometry of a single finger.
+
+        The geometry built with the model is reused for the default angle,
+        and for any angle when the tips are MAP estimates.
+        """
+        if self.amax is not None or theta == DEFAULT_ANGLES[finger]:
+            g = self._geometry
+            return HandGeometry(
+                g.palm, g.tips[finger:finger + 1],
+                g.bases[finger:finger + 1], g.lengths[finger:finger + 1],
+                g.boxes[finger:finger + 1])
+        return hand_geometry(self.center, self.height, [theta], None,
+                             [finger], self.finger_width)
 
-        return (
-            int(round(
-                self.base()[0] + (app_config.PINKY_DEFAULT_RATIO * self.height * np.cos(theta)))),
-            int(round(self.base()[
-                1] + (app_config.PINKY_DEFAULT_RATIO * self.height * np.sin(theta))))
-        )
+    def pinky(self, theta):
+        return _tip(self.finger(PINKY, theta))
 
     def pinkybase(self, theta):
-        i = None
-        if checklineIntersection(self.top_left(), self.top_right(),
-                                 self.base(), self.pinky(theta)):
-            i = lineIntersection(
-                [self.top_left(), self.top_right()],
-                [self.base(), self.pinky(theta)])
-        else:
-            i = lineIntersection(
-                [self.top_left(), self.bottom_left()],
-                [self.base(), self.pinky(theta)])
-
-        return (int(round(i[0])), int(round(i[1])))
+        return _base(self.finger(PINKY, theta))
 
     def pinkylength(self, theta):
-        return cv2.norm(np.array(self.pinkybase(theta)), np.array(self.pinky(theta)))
+        return _length(self.finger(PINKY, theta))
 
     def pinkybox(self, theta):
-        pinky = self.pinky(theta)
-        pinkylen = self.pinkylength(theta)
-        pinkybase = self.pinkybase(theta)
-        pinkytop = (pinkybase[0], pinkybase[1] - pinkylen + 2)
-
-        pinkytl = (pinkytop[0] - self.finger_width, pinkytop[1])
-        pinkytr = (pinkytop[0] + self.finger_width, pinkytop[1])
-        pinkybr = (pinkybase[0] + self.finger_width, pinkybase[1])
-        pinkybl = (pinkybase[0] - self.finger_width, pinkybase[1])
-
-        if self.amax is not None:
-            dy = pinky[1] - pinkybase[1]
-            dx = pinky[0] - pinkybase[0]
-            theta = np.arctan2(dy, dx)
-
-        thetar = theta + (90 * np.pi / 180)
-        tlr = rotatePoint(pinkytl, pinkybase, thetar)
-        trr = rotatePoint(pinkytr, pinkybase, thetar)
-        brr = rotatePoint(pinkybr, pinkybase, thetar)
-        blr = rotatePoint(pinkybl, pinkybase, thetar)
-
-        return [
-            (round(tlr[0]), round(tlr[1])),
-            (round(trr[0]), round(trr[1])),
-            (round(brr[0]), round(brr[1])),
-            (round(blr[0]), round(blr[1])),
-        ]
+        return _box(self.finger(PINKY, theta))
 
     def ring(self, theta):
-        if self.amax is not None:
-            return tuple(self.amax[1])
-
-        return (
-            int(round(
-                self.base()[0] + (app_config.RING_DEFAULT_RATIO * self.height * np.cos(theta)))),
-            int(round(self.base()[
-                1] + (app_config.RING_DEFAULT_RATIO * self.height * np.sin(theta))))
-        )
+        return _tip(self.finger(RING, theta))
 
     def ringbase(self, theta):
-        i = lineIntersection(
-            [self.top_left(), self.top_right()],
-            [self.base(), self.ring(theta)])
-
-        return (int(round(i[0])), int(round(i[1])))
+        return _base(self.finger(RING, theta))
 
     def ringlength(self, theta):
-        return cv2.norm(np.array(self.ringbase(theta)), np.array(self.ring(theta)))
+        return _length(self.finger(RING, theta))
 
     def ringbox(self, theta):
-        ring = self.ring(theta)
-        ringlen = self.ringlength(theta)
-        ringbase = self.ringbase(theta)
-        ringtop = (ringbase[0], ringbase[1] - ringlen + 2)
-
-        ringtl = (ringtop[0] - self.finger_width, ringtop[1])
-        ringtr = (ringtop[0] + self.finger_width, ringtop[1])
-        ringbr = (ringbase[0] + self.finger_width, ringbase[1])
-        ringbl = (ringbase[0] - self.finger_width, ringbase[1])
-
-        if self.amax is not None:
-            dy = ring[1] - ringbase[1]
-            dx = ring[0] - ringbase[0]
-            theta = np.arctan2(dy, dx)
-
-        thetar = theta + (90 * np.pi / 180)
-        tlr = rotatePoint(ringtl, ringbase, thetar)
-        trr = rotatePoint(ringtr, ringbase, thetar)
-        brr = rotatePoint(ringbr, ringbase, thetar)
-        blr = rotatePoint(ringbl, ringbase, thetar)
-
-        return [
-            (round(tlr[0]), round(tlr[1])),
-            (round(trr[0]), round(trr[1])),
-            (round(brr[0]), round(brr[1])),
-            (round(blr[0]), round(blr[1])),
-        ]
+        return _box(self.finger(RING, theta))
 
     def middle(self, theta):
-        if self.amax is not None:
-            return tuple(self.amax[2])
-
-        return (
-            int(round(
-                self.base()[0] + (app_config.MIDDLE_DEFAULT_RATIO * self.height * np.cos(theta)))),
-            int(round(self.base()[
-                1] + (app_config.MIDDLE_DEFAULT_RATIO * self.height * np.sin(theta))))
-        )
+        return _tip(self.finger(MIDDLE, theta))
 
     def middlebase(self, theta):
-        i = lineIntersection(
-            [self.top_left(), self.top_right()],
-            [self.base(), self.middle(theta)])
-
-        return (int(round(i[0])), int(round(i[1])))
+        return _base(self.finger(MIDDLE, theta))
 
     def middlelength(self, theta):
-        return cv2.norm(np.array(self.middlebase(theta)), np.array(self.middle(theta)))
+        return _length(self.finger(MIDDLE, theta))
 
     def middlebox(self, theta):
-        middle = self.middle(theta)
-        middlelen = self.middlelength(theta)
-        middlebase = self.middlebase(theta)
-        middletop = (middlebase[0], middlebase[1] - middlelen + 2)
-
-        middletl = (middletop[0] - self.finger_width, middletop[1])
-        middletr = (middletop[0] + self.finger_width, middletop[1])
-        middlebr = (middlebase[0] + self.finger_width, middlebase[1])
-        middlebl = (middlebase[0] - self.finger_width, middlebase[1])
-
-        if self.amax is not None:
-            dy = middle[1] - middlebase[1]
-            dx = middle[0] - middlebase[0]
-            theta = np.arctan2(dy, dx)
-
-        thetar = theta + (90 * np.pi / 180)
-        tlr = rotatePoint(middletl, middlebase, thetar)
-        trr = rotatePoint(middletr, middlebase, thetar)
-        brr = rotatePoint(middlebr, middlebase, thetar)
-        blr = rotatePoint(middlebl, middlebase, thetar)
-
-        return [
-            (round(tlr[0]), round(tlr[1])),
-            (round(trr[0]), round(trr[1])),
-            (round(brr[0]), round(brr[1])),
-            (round(blr[0]), round(blr[1])),
-        ]
+        return _box(self.finger(MIDDLE, theta))
 
     def index(self, theta):
-        if self.amax is not None:
-            return tuple(self.amax[3])
-
-        return (
-            int(round(
-                self.base()[0] + (app_config.INDEX_DEFAULT_RATIO * self.height * np.cos(theta)))),
-            int(round(self.base()[
-                1] + (app_config.INDEX_DEFAULT_RATIO * self.height * np.sin(theta))))
-        )
+        return _tip(self.finger(INDEX, theta))
 
     def indexbase(self, theta):
-        i = None
-        if checklineIntersection(self.top_left(), self.top_right(),
-                                 self.base(), self.index(theta)):
-            i = lineIntersection(
-                [self.top_left(), self.top_right()],
-                [self.base(), self.index(theta)])
-        else:
-            i = lineIntersection(
-                [self.top_right(), self.bottom_right()],
-                [self.base(), self.index(theta)])
-
-        return (int(round(i[0])), int(round(i[1])))
+        return _base(self.finger(INDEX, theta))
 
     def indexlength(self, theta):
-        return cv2.norm(np.array(self.indexbase(theta)), np.array(self.index(theta)))
+        return _length(self.finger(INDEX, theta))
 
     def indexbox(self, theta):
-        index = self.index(theta)
-        indexlen = self.indexlength(theta)
-        indexbase = self.indexbase(theta)
-        indextop = (indexbase[0], indexbase[1] - indexlen + 2)
-
-        indextl = (indextop[0] - self.finger_width, indextop[1])
-        indextr = (indextop[0] + self.finger_width, indextop[1])
-        indexbr = (indexbase[0] + self.finger_width, indexbase[1])
-        indexbl = (indexbase[0] - self.finger_width, indexbase[1])
-
-        if self.amax is not None:
-            dy = index[1] - indexbase[1]
-            dx = index[0] - indexbase[0]
-            theta = np.arctan2(dy, dx)
-
-        thetar = theta + (90 * np.pi / 180)
-        tlr = rotatePoint(indextl, indexbase, thetar)
-        trr = rotatePoint(indextr, indexbase, thetar)
-        brr = rotatePoint(indexbr, indexbase, thetar)
-        blr = rotatePoint(indexbl, indexbase, thetar)
-
-        return [
-            (round(tlr[0]), round(tlr[1])),
-            (round(trr[0]), round(trr[1])),
-            (round(brr[0]), round(brr[1])),
-            (round(blr[0]), round(blr[1])),
-        ]
+        return _box(self.finger(INDEX, theta))
 
     def thumb(self, theta):
-        if self.amax is not None:
-            return tuple(self.amax[4])
-
-        return (
-            int(round(
-                self.base()[0] + (app_config.THUMB_DEFAULT_RATIO * self.height * np.cos(theta)))),
-            int(round(self.base()[
-                1] + (app_config.THUMB_DEFAULT_RATIO * self.height * np.sin(theta))))
-        )
+        return _tip(self.finger(THUMB, theta))
 
     def thumbbase(self, theta):
-        i = lineIntersection(
-            [self.top_right(), self.bottom_right()],
-            [self.base(), self.thumb(theta)])
-
-        return (int(round(i[0])), int(round(i[1])))
+        return _base(self.finger(THUMB, theta))
 
     def thumblength(self, theta):
-        return cv2.norm(np.array(self.thumbbase(theta)), np.array(self.thumb(theta)))
+        return _length(self.finger(THUMB, theta))
 
     def thumbbox(self, theta):
-        thumb = self.thumb(theta)
-        thumblen = self.thumblength(theta)
-        thumbbase = self.thumbbase(theta)
-        thumbtop = (thumbbase[0], thumbbase[1] - thumblen + 2)
+        return _box(self.finger(THUMB, theta))
 
-        thumbtl = (thumbtop[0] - self.finger_width, thumbtop[1])
-        thumbtr = (thumbtop[0] + self.finger_width, thumbtop[1])
-        thumbbr = (thumbbase[0] + self.finger_width, thumbbase[1])
-        thumbbl = (thumbbase[0] - self.finger_width, thumbbase[1])
 
-        if self.amax is not None:
-            dy = thumb[1] - thumbbase[1]
-            dx = thumb[0] - thumbbase[0]
-            theta = np.arctan2(dy, dx)
-
-        thetar = theta + (90 * np.pi / 180)
-        tlr = rotatePoint(thumbtl, thumbbase, thetar)
-        trr = rotatePoint(thumbtr, thumbbase, thetar)
-        brr = rotatePoint(thumbbr, thumbbase, thetar)
-        blr = rotatePoint(thumbbl, thumbbase, thetar)
-
-        return [
-            (round(tlr[0]), round(tlr[1])),
-            (round(trr[0]), round(trr[1])),
-            (round(brr[0]), round(brr[1])),
-            (round(blr[0]), round(blr[1])),
-        ]
+class HandSide(Hand):
 
+    __slots__ = ()
 
-class HandSide(Hand):
+    width_ratio = 0.31
 
     def __init__(self, center_point, palm_height):
         super().__init__(center_point, palm_height)
-        self.width = round(0.31 * palm_height)
 
     def peak(self):
         return (self.center[0], round(self.center[1] - (self.height / 2)))
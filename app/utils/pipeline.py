@@ -0,0 +1,356 @@
+"""Headless processing pipeline."""
+
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from app.utils.image import FrameContext, readImage
+from app.utils.metrics import metrics
+from app.utils.processing import (
+    do_edges, do_skin_detection, do_threshold, find_contour, find_contours,
+    observe_hand, observe_hands, render_estimate, render_estimates,
+)
+from app.utils.pyramid import PyramidContext, pyramid_estimate
+from app.utils.skin import get_skin_lut
+from app.utils.tracking import HandTracker, RoiTracker
+from config import app_config
+
+
+def default_params():
+    return {
+        'lower': list(app_config.SKIN_LOWER),
+        'upper': list(app_config.SKIN_UPPER),
+        'threshold': app_config.THRESHOLD,
+        'skin_lut': None,
+        'skin_training': None,
+        'skin_mask': None,
+        'track': False,
+        'roi': False,
+        'size': [app_config.IMG_WIDTH, app_config.IMG_HEIHGT],
+        'pyramid': 1,
+        'image_cache': None,
+        'hands': app_config.MAX_HANDS,
+        'render': False
+    }
+
+
+def load_params(path=None, **overrides):
+    """Build pipeline parameters from the defaults, a JSON file and overrides.
+
+    Overrides that are None are ignored so that unset command line arguments
+    fall back to the file or the defaults.
+    """
+    params = default_params()
+
+    if path is not None:
+        with open(path) as f:
+            params.update(json.load(f))
+
+    params.update({k: v for k, v in overrides.items() if v is not None})
+    return params
+
+
+def list_images(directory):
+    """Return the sorted paths of the image files in a directory."""
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        if os.path.splitext(name)[1].lower() in app_config.IMAGE_EXTENSIONS:
+            paths.append(os.path.join(directory, name))
+    return paths
+
+
+def process_image(img, params, ctx=None, tracker=None, roi=None):
+    """Run the full pipeline on a BGR image and return the estimates.
+
+    The estimates are returned as from map_estimates. The overlays of the
+    context are only drawn when params['render'] is set. See estimate_hand
+    for the other arguments.
+    """
+    if ctx is None:
+        ctx = make_context(params)
+
+    estimate = estimate_hand(img, params, ctx, tracker, roi)
+    if params.get('render'):
+        if isinstance(ctx, PyramidContext):
+            ctx = ctx.finest
+        render_estimate(ctx, estimate)
+    return None if estimate is None else estimate.estimates()
+
+
+def process_hands(img, params, ctx=None):
+    """Run the pipeline on a BGR image and return the estimates per hand.
+
+    Returns the estimates of every hand found, largest first, as from
+    map_estimates. See estimate_hands.
+    """
+    if ctx is None:
+        ctx = make_context(params)
+
+    estimates = estimate_hands(img, params, ctx)
+    if params.get('render'):
+        if isinstance(ctx, PyramidContext):
+            ctx = ctx.finest
+        render_estimates(ctx, estimates)
+    return [estimate.estimates() for estimate in estimates]
+
+
+def estimate_hand(frame, params, ctx=None, tracker=None, roi=None):
+    """Estimate the hand in a BGR frame without drawing anything.
+
+    Returns a HandEstimate, or None when no hand contour is found. Pass a
+    context from make_context to reuse its buffers across calls, a
+    HandTracker to warm-start the estimation from the previous frame and a
+    RoiTracker to only search the region around the previous frame's hand.
+    Neither tracker is used with a pyramid of more than one level.
+    """
+    if ctx is None:
+        ctx = make_context(params)
+
+    lut = skin_lut(params)
+
+    ctx.load(frame)
+    if isinstance(ctx, PyramidContext):
+        return pyramid_estimate(ctx, params, lut)
+
+    work = ctx if roi is None else roi.region(ctx)
+    cnt_max = detect_hand(work, params, lut)
+
+    # The hand left the region of interest, or the region cuts through it,
+    # search the whole frame.
+    if work is not ctx and roi.lost(ctx, work, cnt_max):
+        work = ctx
+        cnt_max = detect_hand(ctx, params, lut)
+
+    if roi is not None:
+        roi.update(ctx, cnt_max)
+    return observe_hand(work, cnt_max, tracker)
+
+
+def estimate_hands(frame, params, ctx=None):
+    """Estimate up to params['hands'] hands in a BGR frame.
+
+    Returns a HandEstimate per hand, largest first, see find_contours. The
+    hands are estimated together in one batch. Tracking, the region of
+    interest and coarse-to-fine search only apply to a single hand, so the
+    hands are searched at the finest level of a pyramid context.
+    """
+    if ctx is None:
+        ctx = make_context(params)
+
+    lut = skin_lut(params)
+
+    ctx.load(frame)
+    if isinstance(ctx, PyramidContext):
+        ctx = ctx.finest
+
+    preprocess(ctx, params, lut)
+    contours = find_contours(ctx, params.get('hands'))
+    return observe_hands(ctx, contours)
+
+
+def make_context(params):
+    """Return the frame buffers for the size and pyramid levels in params."""
+    width, height = params.get('size') or (
+        app_config.IMG_WIDTH, app_config.IMG_HEIHGT)
+    levels = params.get('pyramid') or 1
+    if levels > 1:
+        return PyramidContext(width, height, levels)
+    return FrameContext(width, height)
+
+
+def skin_lut(params):
+    """Return the skin lookup table of params, None to use the HSV range."""
+    if not params.get('skin_lut'):
+        return None
+    return get_skin_lut(params['skin_lut'], params.get('skin_training'),
+                        params.get('skin_mask'))
+
+
+def detect_hand(ctx, params, lut=None):
+    """Run the preprocessing stages and return the largest contour."""
+    preprocess(ctx, params, lut)
+    return find_contour(ctx)
+
+
+def preprocess(ctx, params, lut=None):
+    """Run the skin detection, threshold and edge stages."""
+    do_skin_detection(ctx, params['lower'], params['upper'], lut)
+    do_threshold(ctx, params['threshold'])
+    do_edges(ctx)
+
+
+def process_file(path, params, ctx=None, tracker=None, roi=None):
+    """Run the pipeline on an image file and return a JSON-ready record.
+
+    With params['image_cache'] the images are decoded at the processing size
+    once and memory-mapped from that directory on later runs.
+    """
+    img = readImage(path, params.get('size'), params.get('image_cache'))
+    if img is None:
+        return {'file': path, 'error': 'unreadable image'}
+
+    return dict({'file': path}, **image_record(img, params, ctx, tracker, roi))
+
+
+def image_record(img, params, ctx=None, tracker=None, roi=None):
+    """Run the pipeline on a BGR image and return a JSON-ready record.
+
+    With more than one hand in params['hands'] the record also lists the
+    estimates of every hand found under 'hands', largest first, and the
+    estimates are those of the largest.
+    """
+    if (params.get('hands') or 1) > 1:
+        hands = [format_estimates(e) for e in process_hands(img, params, ctx)]
+        return {'estimates': hands[0] if hands else {}, 'hands': hands}
+
+    estimates = process_image(img, params, ctx, tracker, roi)
+    return {'estimates': format_estimates(estimates)}
+
+
+def format_estimates(estimates):
+    """Return estimates as from map_estimates in a JSON-ready form."""
+    return {
+        y: {'tip': [int(c) for c in p], 'posterior': float(cp)}
+        for y, (p, cp) in (estimates or {}).items()
+    }
+
+
+def decode_frame(data, shape=None):
+    """Decode an encoded image, or raw BGR bytes of shape (height, width).
+
+    Returns None when the data is not an image of that shape.
+    """
+    buf = np.frombuffer(data, np.uint8)
+    if shape is None:
+        if len(buf) == 0:
+            return None
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+    height, width = shape
+    if height <= 0 or width <= 0 or len(buf) != height * width * 3:
+        return None
+    return buf.reshape(height, width, 3)
+
+
+# Parameters and frame buffers of a pool worker, set by init_worker.
+_worker_params = None
+_worker_ctx = None
+
+
+def init_worker(params, collect_metrics=False):
+    """Prepare a pool worker to process files with the given parameters.
+
+    OpenCV is limited to one thread per worker so that the pool, not OpenCV,
+    spreads the work over the cores, and a blank frame is pushed through the
+    pipeline once so that lazy initialization is not paid by the first shard.
+    With collect_metrics every shard also returns the worker's metrics.
+    """
+    global _worker_params, _worker_ctx
+    _worker_params = params
+    _worker_ctx = make_context(params)
+
+    cv2.setNumThreads(1)
+    width, height = params.get('size') or (
+        app_config.IMG_WIDTH, app_config.IMG_HEIHGT)
+    process_image(np.zeros((height, width, 3), np.uint8), params, _worker_ctx)
+
+    # Forked workers inherit the metrics of the parent, drop them along with
+    # the warm-up frame.
+    metrics.reset()
+    metrics.enable(collect_metrics)
+
+
+def prepare_workers(params):
+    """Build what the pool workers of params share before starting them.
+
+    The skin lookup table is trained here, once, instead of by every
+    worker at the same time.
+    """
+    skin_lut(params)
+
+
+def process_shard(paths):
+    tracker, roi = trackers(_worker_params)
+    records = [process_file(path, _worker_params, _worker_ctx, tracker, roi)
+               for path in paths]
+    return records, metrics.export() if metrics.enabled else None
+
+
+def process_frames(frames):
+    """Run the pipeline on a batch of independent frames in a pool worker.
+
+    frames are (data, shape) pairs as taken by decode_frame. Returns a
+    record per frame and the worker's metrics, as process_shard.
+    """
+    records = []
+    for data, shape in frames:
+        img = decode_frame(data, shape)
+        if img is None:
+            records.append({'error': 'unreadable image'})
+            continue
+        records.append(image_record(img, _worker_params, _worker_ctx))
+    return records, metrics.export() if metrics.enabled else None
+
+
+def trackers(params):
+    """Return the HandTracker and RoiTracker enabled by the parameters."""
+    tracker = HandTracker() if params.get('track') else None
+    roi = RoiTracker() if params.get('roi') else None
+    return tracker, roi
+
+
+def shard(paths, size):
+    """Split a list of paths into consecutive shards of at most size items."""
+    return [paths[i:i + size] for i in range(0, len(paths), size)]
+
+
+def process_files(paths, params, workers=1, shard_size=16, max_inflight=None):
+    """Yield the record of every file in input order.
+
+    With more than one worker (all cores when workers is None) the paths are
+    sharded over a process pool. At most max_inflight shards, twice the worker
+    count by default, are queued or running at any time so memory stays
+    bounded however long the list.
+
+    When params['track'] or params['roi'] is set, every shard is tracked as
+    a stream of its own and its first image is searched from scratch.
+
+    When metrics are enabled the metrics of the workers are merged into the
+    metrics of this process.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        ctx = make_context(params)
+        tracker, roi = trackers(params)
+        for path in paths:
+            yield process_file(path, params, ctx, tracker, roi)
+        return
+
+    if max_inflight is None:
+        max_inflight = 2 * workers
+
+    prepare_workers(params)
+    shards = iter(shard(paths, shard_size))
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(params, metrics.enabled)) as pool:
+        pending = deque()
+        for paths_shard in shards:
+            pending.append(pool.submit(process_shard, paths_shard))
+            if len(pending) >= max_inflight:
+                break
+
+        while pending:
+            records, exported = pending.popleft().result()
+            if exported:
+                metrics.merge(exported)
+            paths_shard = next(shards, None)
+            if paths_shard is not None:
+                pending.append(pool.submit(process_shard, paths_shard))
+            for record in records:
+                yield record
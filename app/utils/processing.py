@@ -3,14 +3,16 @@
 
 import cv2
 import numpy as np
-from scipy.spatial import KDTree
 
 
 from app.utils.draw import drawHandPalmarBounds
-from app.utils.image import (
-    getImage, setImage,
+from app.utils.estimation import (
+    CLASSES, HandEstimate, iterate_map, iterate_map_batch,
 )
-from app.utils.models import HandPalmar
+from app.utils.geometry import finger_tips
+from app.utils.image import registerImage
+from app.utils.metrics import metrics, timed
+from app.utils.skin import SKIN_KERNEL, skin_lut_mask
 from config import app_config
 
 
@@ -18,191 +20,466 @@ __all__ = ['model_observation', 'do_skin_detection', 'do_threshold',
            'do_edges', 'do_contours', 'import_images']
 
 
-def model_observation(cnt):
-    if cnt is not None:
-        img = getImage('contours')
+def model_observation(ctx, cnt, tracker=None):
+    """Estimate the finger tips on the largest contour and draw the results.
 
-        (cx, cy), cr = cv2.minEnclosingCircle(cnt)
-        center = (int(round(cx)), int(round(cy)))
-        radius = int(round(cr))
-        cv2.circle(img, center, 4, app_config.COLORS['blue'], 2)
-        cv2.circle(img, center, radius, app_config.COLORS['blue'], 2)
+    With a HandTracker the estimation is warm-started from the previous
+    frame, otherwise the palm is searched for from scratch.
+    """
+    estimate = observe_hand(ctx, cnt, tracker)
+    if estimate is None:
+        return None
 
-        candidates = list(map(lambda x: x[0], cv2.convexHull(cnt)))
-        candidate_tree = KDTree(candidates)
-
-        for p in candidates:
-            cv2.circle(img, (p[0], p[1]), 4, app_config.COLORS['red'], 2)
-
-        setImage('estimate', getImage('og').copy())
-        setImage('hypothesis', getImage('og').copy())
-
-        aligned = list(
-            map(lambda x: x[0], filter(lambda p: p[0][0] == center[0], cnt)))
-        base_offset = max(aligned, key=lambda x: x[0])
-
-        base = (base_offset[0] - 8, base_offset[1] - 10)
-        palm_height = base_offset[1] - center[1]
-        palm_center = (base[0], base[1] - int(np.floor(palm_height / 2)))
-        cv2.circle(img, palm_center, 4, app_config.COLORS['red'], 2)
-
-        model = HandPalmar(palm_center, palm_height)
-
-        pinky_angle = -app_config.PINKY_DEFAULT_ANGLE * np.pi / 180
-        pinky = model.pinky(pinky_angle)
-
-        ring_angle = -app_config.RING_DEFAULT_ANGLE * np.pi / 180
-        ring = model.ring(ring_angle)
-
-        middle_angle = -app_config.MIDDLE_DEFAULT_ANGLE * np.pi / 180
-        middle = model.middle(middle_angle)
-
-        index_angle = -app_config.INDEX_DEFAULT_ANGLE * np.pi / 180
-        index = model.index(index_angle)
-
-        thumb_angle = -app_config.THUMB_DEFAULT_ANGLE * np.pi / 180
-        thumb = model.thumb(thumb_angle)
-
-        classes = {
-            'pinky': pinky,
-            'ring': ring,
-            'middle': middle,
-            'index': index,
-            'thumb': thumb
-        }
-
-        # Probabiliity of any given class hypothesis (Prior).
-        py = 1 / len(classes)
-
-        # Probability of any given candidate point.
-        pp = 1 / len(candidates)
-
-        maps = []
-        for candidate in candidates:
-            posteriors = []
-            for y, loc in classes.items():
-                # Probability of point given class.
-                # 1. Find closest points (s < 15) to class hypothesis.
-                leaves = candidate_tree.query(
-                    loc, len(candidates), distance_upper_bound=15)
-                closest = list(filter(
-                    lambda x: np.isfinite(x[0]), np.dstack((leaves[0], leaves[1]))[0]))
-                # 2. Calculate similarity scores for each of the closest points
-                #    based on Euclidean distance from class hypothesis.
-                closest = list(
-                    map(lambda x: [1 / (1 + x[0]), x[1]], closest))
-                # 3. Calculate the total similarity and use it to calculate
-                #    the probability that each point belongs to the class
-                #    based on their similarities.
-                total_sim = sum(map(lambda x: x[0], closest))
-                dist = list(
-                    map(lambda x: [x[0] / total_sim, candidate_tree.data[int(x[1])]], closest))
-                # 4. If candidate in closest at i then P(candidate|y) = P(closest[i]) else
-                #    P(candidate|y) = 0
-                closest = list(
-                    filter(lambda x: x[1][0] == candidate[0] and x[1][1] == candidate[1], dist))
-                pcgy = 0
-                if len(closest) == 1:
-                    pcgy = closest[0][0]
-                # 5. Calculate class posterior
-                cp = (pcgy * py) / pp
-                posteriors.append((y, cp))
-            argmax = max(posteriors, key=lambda x: x[1])
-            maps.append((candidate, argmax))
-
-        estimates = {}
-        for m in maps:
-            if m[1][0] in estimates.keys():
-                if m[1][1] > estimates[m[1][0]][1]:
-                    estimates[m[1][0]] = (m[0], m[1][1])
-            else:
-                estimates[m[1][0]] = (m[0], m[1][1])
-
-        if len(estimates.keys()) == 5:
-            amax = [
-                estimates['pinky'][0],
-                estimates['ring'][0],
-                estimates['middle'][0],
-                estimates['index'][0],
-                estimates['thumb'][0]
-            ]
-            model_projection('hypothesis', palm_center, palm_height)
-            model_projection('estimate', palm_center, palm_height, amax)
-
-
-def model_projection(img_key, palm_center, palm_height, amax=None):
-    setImage(img_key, getImage('og').copy())
-    drawHandPalmarBounds(getImage(img_key), palm_center, palm_height, amax)
-
-
-def do_skin_detection():
-    # define range of HSV intensities that are indicative of skin.
-    lh = cv2.getTrackbarPos('LH', 'Skin Detection')
-    ls = cv2.getTrackbarPos('LS', 'Skin Detection')
-    lv = cv2.getTrackbarPos('LV', 'Skin Detection')
-
-    uh = cv2.getTrackbarPos('UH', 'Skin Detection')
-    us = cv2.getTrackbarPos('US', 'Skin Detection')
-    uv = cv2.getTrackbarPos('UV', 'Skin Detection')
-
-    lower = np.array([lh, ls, lv], np.uint8)
-    upper = np.array([uh, us, uv], np.uint8)
-
-    # Load image and resize it.
-    img = getImage('og').copy()
+    draw_observation(ctx, estimate)
+    return estimate.estimates()
 
-    # Covert colorspace to HSV.
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
 
-    # Define skin mask.
-    # Apply erosions and dilations.
-    # Blur to remove noise.
-    skin_mask = cv2.inRange(hsv, lower, upper)
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (11, 11))
-    skin_mask = cv2.erode(skin_mask, kernel, iterations=1)
-    skin_mask = cv2.dilate(skin_mask, kernel, iterations=1)
-    skin_mask = cv2.GaussianBlur(skin_mask, (3, 3), 0)
+@timed('observation')
+def observe_hand(ctx, cnt, tracker=None):
+    """Estimate the finger tips on the largest contour without drawing.
 
-    # Apply mask to frame to get skin region.
-    skin = cv2.bitwise_and(img, img, mask=skin_mask)
-    setImage('skin', skin)
+    Returns a HandEstimate, or None when there is no contour.
+    """
+    if cnt is None:
+        if tracker is not None:
+            tracker.reset()
+        return None
 
+    candidates = cv2.convexHull(cnt).reshape(-1, 2)
 
-def do_threshold():
-    img = getImage('skin').copy()
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    tv = cv2.getTrackbarPos('Threshold', 'Thresholding')
-    _, thresh = cv2.threshold(gray, tv, 255, cv2.THRESH_BINARY)
-    setImage('thresh', thresh)
+    if tracker is None:
+        palm = find_palm(cnt)
+        hypotheses = finger_tips(palm[2], palm[3])
+        estimates, ctx.diagnostics = iterate_map(candidates, hypotheses)
+    else:
+        estimates, palm, ctx.diagnostics = tracker.estimate(cnt, candidates)
+
+    if metrics.enabled:
+        observe_estimation(cnt, candidates, estimates, ctx.diagnostics)
+
+    return HandEstimate.build(
+        estimates, candidates, cnt, palm, ctx.diagnostics)
+
+
+@timed('observation')
+def observe_hands(ctx, contours):
+    """Estimate the finger tips on several hand contours at once.
+
+    The hypotheses of all the hands are built together and refined by one
+    batched MAP estimation, see iterate_map_batch. Contours without a palm
+    are skipped. Returns a HandEstimate per remaining contour, in the order
+    of the contours, and leaves the diagnostics of the first in ctx.
+    """
+    hands = []
+    for cnt in contours:
+        try:
+            hands.append((cnt, find_palm(cnt)))
+        except ValueError:
+            continue
+
+    ctx.diagnostics = []
+    if not hands:
+        return []
+
+    candidates = [cv2.convexHull(cnt).reshape(-1, 2) for cnt, _ in hands]
+    hypotheses = finger_tips(np.array([palm[2] for _, palm in hands]),
+                             np.array([palm[3] for _, palm in hands]))
+    results = iterate_map_batch(candidates, hypotheses)
+    ctx.diagnostics = results[0][1]
+
+    if metrics.enabled:
+        metrics.observe('hands', len(hands))
+        for (cnt, _), c, (estimates, diagnostics) in zip(
+                hands, candidates, results):
+            observe_estimation(cnt, c, estimates, diagnostics)
+
+    return [
+        HandEstimate.build(estimates, c, cnt, palm, diagnostics)
+        for (cnt, palm), c, (estimates, diagnostics) in zip(
+            hands, candidates, results)
+    ]
+
+
+def observe_estimation(cnt, candidates, estimates, diagnostics):
+    """Record the sizes of the estimation of a frame in the metrics.
+
+    Every MAP round evaluates the distance of every candidate to every class
+    hypothesis.
+    """
+    metrics.observe('contour_points', len(cnt))
+    metrics.observe('hull_candidates', len(candidates))
+    metrics.observe('map_iterations', len(diagnostics))
+    metrics.observe('distance_evaluations',
+                    len(candidates) * len(CLASSES) * len(diagnostics))
+    metrics.observe('estimated_classes', len(estimates))
+
+
+def render_estimate(ctx, estimate):
+    """Draw the contour, candidates, palm and estimates of a HandEstimate.
+
+    A None estimate clears the contour overlay, as do_contours does when
+    there is no contour.
+    """
+    draw_contour(ctx, None if estimate is None else estimate.contour)
+    if estimate is not None:
+        draw_observation(ctx, estimate)
+
+
+def render_estimates(ctx, estimates):
+    """Draw the contours, candidates, palms and estimates of several hands.
+
+    The projections of all the hands share the hypothesis and estimate
+    images, which show the bare frame when there is no hand.
+    """
+    draw_contours(ctx, [estimate.contour for estimate in estimates])
+    np.copyto(ctx.hypothesis, ctx.frame)
+    np.copyto(ctx.estimate, ctx.frame)
+    for estimate in estimates:
+        draw_observation(ctx, estimate, clear=False)
+
+
+@timed('render')
+def draw_observation(ctx, estimate, clear=True):
+    """Draw the candidates, palm and MAP estimates over the frame.
+
+    Without clear the projections are drawn over the hypothesis and
+    estimate images as they are instead of over a copy of the frame.
+    """
+    img = ctx.contours
+    palm_center = estimate.palm_center
+    palm_height = estimate.palm_height
+
+    # The enclosing circle is only known when the palm was searched for.
+    if estimate.circle is not None:
+        center, radius = estimate.circle
+        cv2.circle(img, center, 4, app_config.COLORS['blue'], 2)
+        cv2.circle(img, center, radius, app_config.COLORS['blue'], 2)
+
+    for p in estimate.candidates:
+        cv2.circle(img, (p[0], p[1]), 4, app_config.COLORS['red'], 2)
+
+    cv2.circle(img, palm_center, 4, app_config.COLORS['red'], 2)
+
+    if estimate.found.all():
+        model_projection(
+            ctx, 'hypothesis', palm_center, palm_height, clear=clear)
+        model_projection(
+            ctx, 'estimate', palm_center, palm_height, estimate.tips, clear)
+    elif clear:
+        np.copyto(ctx.hypothesis, ctx.frame)
+        np.copyto(ctx.estimate, ctx.frame)
+
+
+def find_palm(cnt):
+    """Search the contour of a hand for its palm.
+
+    Returns the center and radius of the enclosing circle of the contour and
+    the center and height of the palm.
+    """
+    (cx, cy), cr = cv2.minEnclosingCircle(cnt)
+    center = (int(round(cx)), int(round(cy)))
+    radius = int(round(cr))
+
+    # First contour point straight below or above the circle center.
+    points = cnt.reshape(-1, 2)
+    aligned = np.flatnonzero(points[:, 0] == center[0])
+    if len(aligned) == 0:
+        raise ValueError('no contour point aligned with the palm center')
+    base_offset = points[aligned[0]]
+
+    base = (base_offset[0] - 8, base_offset[1] - 10)
+    palm_height = base_offset[1] - center[1]
+    palm_center = (base[0], base[1] - int(np.floor(palm_height / 2)))
+    return center, radius, palm_center, palm_height
+
+
+def model_projection(ctx, img_key, palm_center, palm_height, amax=None,
+                     clear=True):
+    img = ctx.get(img_key)
+    if clear:
+        np.copyto(img, ctx.frame)
+    drawHandPalmarBounds(img, palm_center, palm_height, amax)
+
+
+@timed('skin_detection')
+def do_skin_detection(ctx, lower=None, upper=None, lut=None):
+    # Classify the pixels with the skin lookup table when one is given,
+    # otherwise with a range of HSV intensities that are indicative of skin.
+    if lut is not None:
+        skin_from_lut(ctx, lut)
+        return
+
+    # Read the HSV range from the trackbars unless it is given explicitly.
+    if lower is None:
+        lh = cv2.getTrackbarPos('LH', 'Skin Detection')
+        ls = cv2.getTrackbarPos('LS', 'Skin Detection')
+        lv = cv2.getTrackbarPos('LV', 'Skin Detection')
+        lower = (lh, ls, lv)
+
+    if upper is None:
+        uh = cv2.getTrackbarPos('UH', 'Skin Detection')
+        us = cv2.getTrackbarPos('US', 'Skin Detection')
+        uv = cv2.getTrackbarPos('UV', 'Skin Detection')
+        upper = (uh, us, uv)
 
+    # Covert colorspace to HSV.
+    cv2.cvtColor(ctx.og, cv2.COLOR_BGR2HSV, ctx.hsv)
+    skin_from_hsv(ctx, lower, upper)
 
-def do_edges():
-    img = getImage('thresh').copy()
-    blur = cv2.GaussianBlur(img, (0, 0), 3)
-    edges = cv2.Canny(blur, 100, 200)
-    setImage('edges', edges)
 
+def skin_from_hsv(ctx, lower, upper):
+    """Detect the skin in the HSV image already converted into ctx.hsv."""
+    lower = np.array(lower, np.uint8)
+    upper = np.array(upper, np.uint8)
+
+    # Define skin mask.
+    cv2.inRange(ctx.hsv, lower, upper, ctx.scratch)
+    _skin_from_mask(ctx)
 
-def do_contours():
-    img = getImage('edges').copy()
-    border = img.copy()
-    _, contours, _ = cv2.findContours(
-        border, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
 
-    if len(contours) != 0:
-        cnt_max = max(contours, key=lambda cnt: cv2.contourArea(cnt))
-        og = getImage('og').copy()
-        cv2.drawContours(og, [cnt_max], -1, app_config.COLORS['green'], 2)
+def skin_from_lut(ctx, lut):
+    """Detect the skin in ctx.og with a skin lookup table."""
+    skin_lut_mask(ctx.og, lut, ctx.scratch, ctx.bgra)
+    _skin_from_mask(ctx)
 
-        setImage('contours', og)
-        return cnt_max
+
+def _skin_from_mask(ctx):
+    # Clean up the raw skin mask in ctx.scratch.
+    # Apply erosions and dilations.
+    # Blur to remove noise.
+    cv2.erode(ctx.scratch, SKIN_KERNEL, ctx.mask, iterations=1)
+    cv2.dilate(ctx.mask, SKIN_KERNEL, ctx.scratch, iterations=1)
+    cv2.GaussianBlur(ctx.scratch, (3, 3), 0, ctx.mask)
+
+    # Apply mask to frame to get skin region. Pixels outside the mask are
+    # left untouched by OpenCV, so clear the previous frame first.
+    ctx.skin.fill(0)
+    cv2.bitwise_and(ctx.og, ctx.og, ctx.skin, mask=ctx.mask)
+
+
+@timed('threshold')
+def do_threshold(ctx, tv=None):
+    cv2.cvtColor(ctx.skin, cv2.COLOR_BGR2GRAY, ctx.gray)
+    if tv is None:
+        tv = cv2.getTrackbarPos('Threshold', 'Thresholding')
+    threshold_gray(ctx, tv)
+
+
+def threshold_gray(ctx, tv):
+    """Threshold the grayscale skin image already converted into ctx.gray."""
+    cv2.threshold(ctx.gray, tv, 255, cv2.THRESH_BINARY, ctx.thresh)
+
+
+@timed('edges')
+def do_edges(ctx):
+    cv2.GaussianBlur(ctx.thresh, (0, 0), 3, ctx.blur)
+    cv2.Canny(ctx.blur, 100, 200, ctx.edges)
+
+
+def do_contours(ctx):
+    cnt_max = find_contour(ctx)
+    draw_contour(ctx, cnt_max)
+    return cnt_max
+
+
+@timed('contours')
+def find_contour(ctx, components=None):
+    """Return the largest contour in the edges, or None if there is none.
+
+    Only external contours are traced, the largest contour always is one.
+    With components the edges are first labelled into connected components
+    and only the components whose bounding box could hold the largest
+    contour are traced. This is much faster on noisy edges with thousands
+    of specks, but slower on clean ones.
+    """
+    contours = _find_contours(ctx, 1, 0, components)
+    return contours[0] if contours else None
+
+
+@timed('contours')
+def find_contours(ctx, count=None, min_area=None, components=None):
+    """Return the largest contours in the edges, largest first.
+
+    These are at most count contours, MAX_HANDS by default, whose area is at
+    least min_area, HAND_MIN_AREA by default, times the area of the largest
+    one. A contour whose bounding box overlaps that of a larger one is taken
+    for a piece of the same hand and skipped, unless the two outline
+    separate thresholded blobs whose boxes only partly overlap. The
+    contours are searched as by find_contour and only those that could be
+    among them have their area computed.
+    """
+    if count is None:
+        count = app_config.MAX_HANDS
+    if min_area is None:
+        min_area = app_config.HAND_MIN_AREA
+    return _find_contours(ctx, max(count, 1), min_area, components)
+
+
+def _find_contours(ctx, count, min_area, components):
+    if components is None:
+        components = app_config.CONTOUR_COMPONENTS
+    pieces = _HandPieces(ctx)
+    if components:
+        return _largest_components(ctx, count, min_area, pieces)
+
+    # OpenCV 3 modifies the source image, so search a copy of the edges.
+    # It also returns (image, contours, hierarchy), later versions drop the
+    # image.
+    np.copyto(ctx.border, ctx.edges)
+    contours = cv2.findContours(
+        ctx.border, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE,
+        offset=ctx.offset)[-2]
+    if len(contours) == 0:
+        return []
+
+    # A closed chain of n 8-connected points encloses at most n^2 / (2 pi),
+    # so only the longest contours need their area computed.
+    n = np.fromiter(map(len, contours), np.int64, len(contours))
+    bound = n * n / (2 * np.pi)
+    return _largest(bound, lambda i: contours[i], count, min_area, pieces)
+
+
+def _largest_components(ctx, count, min_area, pieces=None):
+    n, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(
+        ctx.edges, 8, cv2.CV_32S, cv2.CCL_GRANA, ctx.labels)
+    if n <= 1:
+        return []
+
+    # A contour through the pixels of a w x h box encloses at most
+    # (w - 1) * (h - 1). Label 0 is the background.
+    stats = stats[1:]
+    bound = ((stats[:, cv2.CC_STAT_WIDTH] - 1) *
+             (stats[:, cv2.CC_STAT_HEIGHT] - 1))
+    return _largest(
+        bound, lambda i: _trace_component(ctx, int(i) + 1, stats[i]),
+        count, min_area, pieces)
+
+
+def _largest(bound, contour, count=1, min_area=0, pieces=None):
+    # Compute the area of the contours in decreasing order of their upper
+    # bound until no remaining contour can be among the count largest, or
+    # reach min_area times the largest found so far. Equal areas keep the
+    # order of the bounds.
+    found = []
+    largest = []
+    for i in np.argsort(-bound, kind='stable'):
+        if len(largest) == count and bound[i] <= largest[-1][0]:
+            break
+        if largest and bound[i] < min_area * largest[0][0]:
+            break
+        cnt = contour(i)
+        area = cv2.contourArea(cnt)
+        j = len(found)
+        while j > 0 and found[j - 1][0] < area:
+            j -= 1
+        found.insert(j, (area, cnt))
+        largest = found[:1] if count == 1 else _separate(
+            found, count, pieces)
+
+    if not largest:
+        return []
+    return [cnt for area, cnt in largest
+            if area >= min_area * largest[0][0]]
+
+
+def _separate(found, count, pieces):
+    # The edges of one hand often break into several contours. Keep the
+    # largest contours that are not pieces of a larger kept one.
+    kept = []
+    boxes = []
+    for area, cnt in found:
+        box = cv2.boundingRect(cnt)
+        if any(pieces.same(cnt, box, other, other_box)
+               for (_, other), other_box in zip(kept, boxes)):
+            continue
+        kept.append((area, cnt))
+        boxes.append(box)
+        if len(kept) == count:
+            break
+    return kept
+
+
+class _HandPieces(object):
+    """Tells the pieces of one hand from other hands among its contours.
+
+    Two contours whose bounding boxes overlap are pieces of one hand when
+    one box lies in the other, as for a finger tip cut off from its hand,
+    or when they run along the same thresholded blob. Hands side by side
+    are separate blobs whose boxes only partly overlap. The blobs are only
+    labelled once two boxes overlap.
+    """
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.labels = None
+        self.blobs = {}
+
+    def same(self, a, box_a, b, box_b):
+        if not _overlap(box_a, box_b):
+            return False
+        if _inside(box_a, box_b) or _inside(box_b, box_a):
+            return True
+        return not self._blobs(a).isdisjoint(self._blobs(b))
+
+    def _blobs(self, cnt):
+        # The contours stay alive while they are separated.
+        key = id(cnt)
+        if key not in self.blobs:
+            if self.labels is None:
+                # The edges run along the border of the blobs or next to
+                # it, so grow the blobs by a pixel before labelling them.
+                grown = cv2.dilate(self.ctx.thresh, None)
+                self.labels = cv2.connectedComponents(
+                    grown, connectivity=8)[1]
+            points = cnt.reshape(-1, 2) - self.ctx.offset
+            blobs = set(self.labels[points[:, 1], points[:, 0]].tolist())
+            self.blobs[key] = blobs - {0}
+        return self.blobs[key]
+
+
+def _overlap(a, b):
+    # Whether the boxes a and b overlap.
+    return (a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and
+            a[1] < b[1] + b[3] and b[1] < a[1] + a[3])
+
+
+def _inside(a, b):
+    # Whether the box a lies in the box b.
+    return (b[0] <= a[0] and a[0] + a[2] <= b[0] + b[2] and
+            b[1] <= a[1] and a[1] + a[3] <= b[1] + b[3])
+
+
+def _trace_component(ctx, label, stat):
+    # Trace one labelled component in its bounding box, grown by a pixel so
+    # that findContours sees it surrounded by background.
+    x, y, w, h = (int(v) for v in stat[:4])
+    x0, y0 = max(x - 1, 0), max(y - 1, 0)
+    x1, y1 = min(x + w + 1, ctx.width), min(y + h + 1, ctx.height)
+
+    mask = ctx.border[y0:y1, x0:x1]
+    cv2.compare(ctx.labels[y0:y1, x0:x1], label, cv2.CMP_EQ, mask)
+
+    # OpenCV 3 returns (image, contours, hierarchy), later versions drop the
+    # image.
+    offset = (ctx.offset[0] + x0, ctx.offset[1] + y0)
+    return cv2.findContours(
+        mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=offset)[-2][0]
+
+
+def draw_contour(ctx, cnt):
+    draw_contours(ctx, [] if cnt is None else [cnt])
+
+
+def draw_contours(ctx, contours):
+    if contours:
+        np.copyto(ctx.contours, ctx.frame)
+        cv2.drawContours(
+            ctx.contours, contours, -1, app_config.COLORS['green'], 2)
     else:
-        w = app_config.IMG_WIDTH
-        h = app_config.IMG_HEIHGT
-        setImage('contours', np.zeros((h, w, 1), np.uint8))
-        return None
+        ctx.contours.fill(0)
 
 
 def import_images():
-    for name, img in app_config.IMAGES.items():
-        setImage(name, cv2.imread(img, cv2.IMREAD_COLOR))
+    # Images are only decoded when first used, see ImageRegistry.
+    for name, path in app_config.IMAGES.items():
+        registerImage(name, path)
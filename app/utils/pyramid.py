@@ -0,0 +1,168 @@
+"""Coarse-to-fine estimation over an image pyramid.
+
+The hand contour, the palm and the convex hull candidates are found on the
+coarsest level of the pyramid. The candidates are then refined level by
+level, processing only a small window around each of them, and the fingers
+are estimated at the finest level.
+"""
+
+import cv2
+import numpy as np
+
+from app.utils.estimation import HandEstimate, iterate_map
+from app.utils.geometry import finger_tips
+from app.utils.image import FrameContext
+from app.utils.processing import (
+    SKIN_KERNEL, do_edges, do_skin_detection, do_threshold, find_contour,
+    find_palm, skin_from_hsv, skin_from_lut, threshold_gray,
+)
+from config import app_config
+
+
+# Pixels around a refinement window that its skin mask depends on: the
+# erosion and dilation each reach half the kernel, the blur one pixel.
+WINDOW_MARGIN = 2 * (SKIN_KERNEL.shape[0] // 2) + 1
+
+
+class PyramidContext(object):
+    """Frame contexts for every level of an image pyramid, finest first."""
+
+    def __init__(self, width=app_config.IMG_WIDTH,
+                 height=app_config.IMG_HEIHGT, levels=None):
+        if levels is None:
+            levels = app_config.PYRAMID_LEVELS
+
+        self.levels = []
+        for _ in range(max(levels, 1)):
+            self.levels.append(FrameContext(width, height))
+            width = (width + 1) // 2
+            height = (height + 1) // 2
+
+        # Refinement windows stacked into one image, see window_stack.
+        self.windows = None
+
+    @property
+    def finest(self):
+        return self.levels[0]
+
+    @property
+    def coarsest(self):
+        return self.levels[-1]
+
+    def load(self, img):
+        """Resize an image into the finest level and build the pyramid."""
+        self.finest.load(img)
+        for fine, coarse in zip(self.levels, self.levels[1:]):
+            cv2.pyrDown(fine.og, coarse.og, (coarse.width, coarse.height))
+
+    def window_stack(self, count, size):
+        """Return a context for count square windows stacked vertically.
+
+        Its buffers are reused by later calls that need no more room.
+        """
+        windows = self.windows
+        if windows is None or windows.width != size or \
+                windows.height < count * size:
+            windows = self.windows = FrameContext(size, count * size)
+        return windows.roi(0, 0, size, count * size)
+
+
+def refine_candidates(ctx, candidates, center, params, lut=None,
+                      radius=None, pyramid=None):
+    """Move every candidate to the skin pixel furthest from the palm center.
+
+    Only a window of the given radius around each candidate is thresholded.
+    The windows, grown by the reach of the skin mask clean-up, are stacked
+    into a single image that goes through skin detection and thresholding
+    at once, so every window is thresholded as in the whole frame.
+    Candidates without skin in their window are kept where they are.
+    The stacked windows reuse the buffers of pyramid when it is given.
+    """
+    if radius is None:
+        radius = app_config.PYRAMID_WINDOW
+
+    candidates = np.asarray(candidates).reshape(-1, 2)
+    if len(candidates) == 0:
+        return candidates.copy()
+
+    n = len(candidates)
+    grown = radius + WINDOW_MARGIN
+    size = 2 * grown + 1
+    if pyramid is None:
+        stack = FrameContext(size, n * size)
+    else:
+        stack = pyramid.window_stack(n, size)
+
+    # Windows reaching past the frame repeat its edge pixels.
+    for i, (x, y) in enumerate(candidates):
+        x0, y0 = max(x - grown, 0), max(y - grown, 0)
+        x1 = min(x + grown + 1, ctx.width)
+        y1 = min(y + grown + 1, ctx.height)
+        cv2.copyMakeBorder(
+            ctx.og[y0:y1, x0:x1], y0 - y + grown, y + grown + 1 - y1,
+            x0 - x + grown, x + grown + 1 - x1, cv2.BORDER_REPLICATE,
+            stack.og[i * size:(i + 1) * size])
+
+    if lut is None:
+        cv2.cvtColor(stack.og, cv2.COLOR_BGR2HSV, stack.hsv)
+        skin_from_hsv(stack, params['lower'], params['upper'])
+    else:
+        skin_from_lut(stack, lut)
+    cv2.cvtColor(stack.skin, cv2.COLOR_BGR2GRAY, stack.gray)
+    threshold_gray(stack, params['threshold'])
+
+    # The furthest thresholded pixel of every window, without the margin.
+    offsets = np.arange(-radius, radius + 1)
+    xs = np.clip(candidates[:, 0, np.newaxis] + offsets, 0, ctx.width - 1)
+    ys = np.clip(candidates[:, 1, np.newaxis] + offsets, 0, ctx.height - 1)
+    inner = slice(WINDOW_MARGIN, size - WINDOW_MARGIN)
+    thresh = stack.thresh.reshape(n, size, size)[:, inner, inner]
+    d = ((xs[:, np.newaxis, :] - center[0]) ** 2 +
+         (ys[:, :, np.newaxis] - center[1]) ** 2)
+    d = np.where(thresh > 0, d, -1).reshape(n, -1)
+    j = np.argmax(d, axis=1)
+    found = d[np.arange(n), j] >= 0
+
+    width = 2 * radius + 1
+    refined = candidates.copy()
+    refined[found, 0] = xs[found, j[found] % width]
+    refined[found, 1] = ys[found, j[found] // width]
+    return refined
+
+
+def pyramid_estimate(pyramid, params, lut=None):
+    """Estimate the finger tips coarse-to-fine.
+
+    Returns a HandEstimate in the coordinates of the finest level, or None
+    when the coarsest level has no contour.
+    """
+    coarse = pyramid.coarsest
+    do_skin_detection(coarse, params['lower'], params['upper'], lut)
+    do_threshold(coarse, params['threshold'])
+    do_edges(coarse)
+    cnt = find_contour(coarse)
+    if cnt is None:
+        return None
+
+    candidates = cv2.convexHull(cnt).reshape(-1, 2)
+    center, radius, palm_center, palm_height = find_palm(cnt)
+
+    # Candidates are refined at every finer level, the palm is only scaled.
+    for level in reversed(pyramid.levels[:-1]):
+        candidates = candidates * 2
+        palm_center = (palm_center[0] * 2, palm_center[1] * 2)
+        palm_height = palm_height * 2
+        candidates = refine_candidates(
+            level, candidates, palm_center, params, lut, pyramid=pyramid)
+
+    scale = 2 ** (len(pyramid.levels) - 1)
+    ctx = pyramid.finest
+    hypotheses = finger_tips(palm_center, palm_height)
+    estimates, ctx.diagnostics = iterate_map(candidates, hypotheses)
+
+    palm = (
+        (center[0] * scale, center[1] * scale), radius * scale,
+        palm_center, palm_height
+    )
+    return HandEstimate.build(
+        estimates, candidates, cnt * scale, palm, ctx.diagnostics)
@@ -0,0 +1,218 @@
+"""Ring of frame slots in shared memory for multi-process pipelines.
+
+Every slot holds a frame and its skin, threshold and edge masks in one
+shared memory block, so the processes of a pipeline split into stages, e.g.
+capture, preprocessing and observation, pass frames on as a slot index and
+sequence number instead of pickling the arrays. Every process maps the
+slots as NumPy arrays without copying.
+
+A slot is owned by one stage at a time:
+
+    index, seq = ring.claim()                 # stage 0, blocks while full
+    ring.array('og', index)[:] = frame
+    ring.pass_on(index, seq, 0)               # now owned by stage 1
+
+    index, seq = ring.receive(1)              # stage 1
+    ctx = ring.context(index)
+    do_skin_detection(ctx, lower, upper)
+    ...
+    ring.release(index, seq, 1)               # last stage, slot is free
+
+The ring is passed to the stage processes as a Process argument.
+"""
+
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from app.utils.image import FrameContext
+from config import app_config
+
+
+# Buffers of a FrameContext held in every slot, with their channel counts.
+SHARED = (('og', 3), ('skin', 3), ('thresh', 1), ('edges', 1))
+
+# Owner of a slot that no stage holds.
+FREE = -1
+
+
+class FrameRing(object):
+    """Preallocated frame slots in shared memory handed between stages.
+
+    Stage 0 claims free slots and every stage passes the slots it is done
+    with on to the next, the last one releases them. The stages receive
+    (index, seq) pairs in the order they were passed on, where seq numbers
+    the claims across the whole ring. Only the owning stage may touch the
+    arrays of a slot; pass_on and release check ownership and raise
+    ValueError for a slot the stage does not hold.
+
+    Backpressure: there are never more than slots frames in flight. claim
+    blocks until the last stage releases a slot, or raises queue.Empty
+    after timeout seconds, or at once without block, so a producer can
+    choose between waiting and dropping frames.
+    """
+
+    def __init__(self, slots, width=app_config.IMG_WIDTH,
+                 height=app_config.IMG_HEIHGT, stages=2, mp_context=None):
+        if mp_context is None:
+            mp_context = get_context()
+
+        self.slots = slots
+        self.width = width
+        self.height = height
+        self.stages = stages
+
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=self._size())
+        self.owner_shm = True
+
+        self.lock = mp_context.Lock()
+        self.free = mp_context.Queue()
+        self.ready = [mp_context.Queue() for _ in range(stages - 1)]
+        self._map()
+        self.header[:] = 0
+        self.owners[:] = FREE
+        for index in range(slots):
+            self.free.put(index)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('shm', 'header', 'owners', 'sequences', 'arrays',
+                    '_ctx'):
+            state.pop(key, None)
+        state['name'] = self.shm.name
+        state['owner_shm'] = False
+        return state
+
+    def __setstate__(self, state):
+        name = state.pop('name')
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=name)
+        self._map()
+
+    def _layout(self):
+        # Byte size of one slot's buffer and of the whole slot.
+        sizes = [self.width * self.height * c for _, c in SHARED]
+        return sizes, sum(sizes)
+
+    def _size(self):
+        return 8 * (1 + 2 * self.slots) + self.slots * self._layout()[1]
+
+    def _map(self):
+        # The header holds the sequence counter, then the owner and
+        # sequence number of every slot, followed by the slots.
+        buf = self.shm.buf
+        self.header = np.ndarray(1 + 2 * self.slots, np.int64, buf)
+        self.owners = self.header[1:1 + self.slots]
+        self.sequences = self.header[1 + self.slots:]
+
+        sizes, slot_size = self._layout()
+        offset = self.header.nbytes
+        self.arrays = {}
+        for index in range(self.slots):
+            start = offset + index * slot_size
+            for (key, channels), size in zip(SHARED, sizes):
+                shape = (self.height, self.width)
+                if channels > 1:
+                    shape += (channels,)
+                self.arrays[key, index] = np.ndarray(shape, np.uint8, buf,
+                                                     start)
+                start += size
+        self._ctx = None
+
+    def array(self, key, index):
+        """Return the key buffer of a slot, a view of the shared memory."""
+        return self.arrays[key, index]
+
+    def context(self, index, ctx=None):
+        """Return a FrameContext whose SHARED buffers are the slot's.
+
+        The other buffers are the scratch buffers of ctx, or of a context
+        kept by this process, so all the processing stages run on a slot
+        without copying.
+        """
+        if ctx is None:
+            if self._ctx is None:
+                self._ctx = FrameContext(self.width, self.height)
+            ctx = self._ctx
+
+        slot = FrameContext.__new__(FrameContext)
+        slot.__dict__.update(ctx.__dict__)
+        for key, _ in SHARED:
+            setattr(slot, key, self.arrays[key, index])
+        slot.diagnostics = []
+        slot.frame = slot.og
+        slot.offset = (0, 0)
+        return slot
+
+    def claim(self, block=True, timeout=None):
+        """Take a free slot for stage 0 and return its (index, seq)."""
+        index = self.free.get(block, timeout)
+        with self.lock:
+            seq = int(self.header[0])
+            self.header[0] += 1
+            self.sequences[index] = seq
+            self.owners[index] = 0
+        return index, seq
+
+    def pass_on(self, index, seq, stage):
+        """Hand a slot held by stage on to the next stage."""
+        if stage >= self.stages - 1:
+            raise ValueError('the last stage releases its slots')
+        self._check(index, seq, stage)
+        self.owners[index] = stage + 1
+        self.ready[stage].put((index, seq))
+
+    def receive(self, stage, block=True, timeout=None):
+        """Return the (index, seq) of the next slot passed on to stage.
+
+        Returns None once the previous stage has called finish. Raises
+        queue.Empty like Queue.get when no slot arrives in time.
+        """
+        if stage < 1:
+            raise ValueError('stage 0 claims its slots')
+        return self.ready[stage - 1].get(block, timeout)
+
+    def finish(self, stage):
+        """Tell the next stage that stage will pass on no more slots."""
+        if stage < self.stages - 1:
+            self.ready[stage].put(None)
+
+    def release(self, index, seq, stage=None):
+        """Free a slot held by the last stage."""
+        if stage is None:
+            stage = self.stages - 1
+        if stage != self.stages - 1:
+            raise ValueError('only the last stage releases its slots')
+        self._check(index, seq, stage)
+        self.owners[index] = FREE
+        self.free.put(index)
+
+    def valid(self, index, seq):
+        """Whether the slot still holds the frame claimed as seq."""
+        return (self.owners[index] != FREE and
+                int(self.sequences[index]) == seq)
+
+    def _check(self, index, seq, stage):
+        if self.owners[index] != stage or int(self.sequences[index]) != seq:
+            raise ValueError(
+                'slot {0} (seq {1}) is not held by stage {2}'.format(
+                    index, seq, stage))
+
+    def close(self):
+        """Unmap the slots, and free the shared memory in the creator.
+
+        Arrays returned by array and context must no longer be used.
+        """
+        self.header = self.owners = self.sequences = None
+        self.arrays = {}
+        self._ctx = None
+        self.shm.close()
+        if self.owner_shm:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
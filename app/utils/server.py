@@ -0,0 +1,313 @@
+"""Asyncio inference server.
+
+Frames are posted over HTTP, on a TCP port or a Unix socket, and answered
+with their fingertip estimates. Concurrent requests are gathered into
+micro-batches that run on a process pool, so the event loop only parses
+requests while the workers run the pipeline.
+
+    POST /estimate                  encoded image (JPEG, PNG, ...)
+    POST /estimate?width=W&height=H raw BGR frame of W x H pixels
+    GET /metrics                    metrics in the Prometheus text format
+    GET /health                     queue depth and batches in flight
+"""
+
+import asyncio
+import json
+import os
+import signal
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+from app.utils.metrics import metrics
+from app.utils.pipeline import init_worker, prepare_workers, process_frames
+from config import app_config
+
+
+# A request waiting to be batched: the (data, shape) frame, the future its
+# record is set on and the loop time it arrived at.
+Pending = namedtuple('Pending', ['frame', 'future', 'arrival'])
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable'
+}
+
+
+class HttpError(Exception):
+
+    def __init__(self, status, message=None):
+        super(HttpError, self).__init__(message or REASONS[status])
+        self.status = status
+
+
+class MicroBatcher(object):
+    """Gather submitted frames into batches and run them on an executor.
+
+    A batch is started once a worker is free. It takes every frame already
+    waiting, up to max_batch, and waits for more only until the oldest of
+    them has waited max_latency seconds. At most max_inflight batches run
+    at a time and at most max_queue frames wait, submit raises
+    asyncio.QueueFull beyond that.
+    """
+
+    def __init__(self, executor, run_batch, max_batch=None, max_latency=None,
+                 max_inflight=1, max_queue=None):
+        if max_batch is None:
+            max_batch = app_config.SERVER_MAX_BATCH
+        if max_latency is None:
+            max_latency = app_config.SERVER_MAX_LATENCY / 1000
+        if max_queue is None:
+            max_queue = app_config.SERVER_MAX_QUEUE
+
+        self.executor = executor
+        self.run_batch = run_batch
+        self.max_batch = max(max_batch, 1)
+        self.max_latency = max_latency
+        self.max_inflight = max(max_inflight, 1)
+        self.queue = asyncio.Queue(max_queue)
+        self.inflight = 0
+        self.slots = None
+        self.task = None
+
+    def start(self):
+        self.slots = asyncio.Semaphore(self.max_inflight)
+        self.task = asyncio.get_running_loop().create_task(self._batches())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def submit(self, frame):
+        """Queue a frame and return its record once its batch has run."""
+        loop = asyncio.get_running_loop()
+        pending = Pending(frame, loop.create_future(), loop.time())
+        self.queue.put_nowait(pending)
+        try:
+            return await pending.future
+        finally:
+            metrics.observe('request_seconds', loop.time() - pending.arrival)
+
+    async def _batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = batch[0].arrival + self.max_latency
+            while len(batch) < self.max_batch:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(
+                        await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            metrics.observe('queue_depth', self.queue.qsize())
+            metrics.observe('batch_size', len(batch))
+            self.inflight += 1
+            loop.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            records, exported = await loop.run_in_executor(
+                self.executor, self.run_batch, [p.frame for p in batch])
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+        else:
+            if exported:
+                metrics.merge(exported)
+            for pending, record in zip(batch, records):
+                if not pending.future.done():
+                    pending.future.set_result(record)
+        finally:
+            metrics.observe('batch_seconds', time.perf_counter() - start)
+            self.inflight -= 1
+            self.slots.release()
+
+
+class InferenceServer(object):
+    """HTTP/1.1 front end of a MicroBatcher over a pool of pipeline workers.
+
+    Every worker runs the pipeline with params, see init_worker. Frames are
+    independent: neither tracker is used.
+    """
+
+    def __init__(self, params, workers=None, max_batch=None, max_latency=None,
+                 max_queue=None, max_body=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if max_body is None:
+            max_body = app_config.SERVER_MAX_BODY
+
+        self.params = dict(params, track=False, roi=False, render=False)
+        self.workers = max(workers, 1)
+        self.max_body = max_body
+        self.pool = None
+        self.batcher = MicroBatcher(None, process_frames, max_batch,
+                                    max_latency, self.workers, max_queue)
+
+    async def serve(self, host='127.0.0.1', port=8080, unix=None):
+        """Serve until cancelled, on the Unix socket path unix if given.
+
+        SIGTERM cancels serving too, so that the pool and socket are cleaned
+        up.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGTERM,
+                                    asyncio.current_task().cancel)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+        metrics.enable()
+        prepare_workers(self.params)
+        self.pool = ProcessPoolExecutor(self.workers, initializer=init_worker,
+                                        initargs=(self.params, True))
+        self.batcher.executor = self.pool
+        self.batcher.start()
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle, unix)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+            self.pool.shutdown(cancel_futures=True)
+            if unix is not None and os.path.exists(unix):
+                os.unlink(unix)
+
+    async def handle(self, reader, writer):
+        """Answer the requests of a connection until it is closed."""
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HttpError as e:
+                    await self.respond(writer, e.status, {'error': str(e)},
+                                       keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                method, target, headers, body = request
+                try:
+                    status, payload = await self.route(method, target, body)
+                except HttpError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except asyncio.QueueFull:
+                    status, payload = 503, {'error': 'server busy'}
+                except Exception as e:
+                    status, payload = 500, {'error': str(e)}
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """Return the method, target, headers and body of the next request.
+
+        Returns None when the connection was closed between requests.
+        """
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, _ = line.decode('latin-1').split()
+        except ValueError:
+            raise HttpError(400, 'malformed request line')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HttpError(411)
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HttpError(400, 'malformed Content-Length')
+        if length > self.max_body:
+            raise HttpError(413)
+        body = await reader.readexactly(length) if length > 0 else b''
+        return method.upper(), target, headers, body
+
+    async def route(self, method, target, body):
+        """Return the status and payload answering a request."""
+        url = urlsplit(target)
+        if url.path == '/estimate':
+            if method != 'POST':
+                raise HttpError(405)
+            record = await self.batcher.submit((body, frame_shape(url.query)))
+            return (400 if 'error' in record else 200), record
+        if url.path == '/metrics':
+            if method != 'GET':
+                raise HttpError(405)
+            return 200, metrics.to_prometheus()
+        if url.path == '/health':
+            if method != 'GET':
+                raise HttpError(405)
+            return 200, {
+                'status': 'ok',
+                'queue': self.batcher.queue.qsize(),
+                'inflight': self.batcher.inflight
+            }
+        raise HttpError(404)
+
+    async def respond(self, writer, status, payload, keep_alive=True):
+        if isinstance(payload, str):
+            body, kind = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+        else:
+            body, kind = json.dumps(payload).encode('utf-8'), \
+                'application/json'
+        head = ('HTTP/1.1 {0} {1}\r\nContent-Type: {2}\r\n'
+                'Content-Length: {3}\r\nConnection: {4}\r\n\r\n').format(
+                    status, REASONS[status], kind, len(body),
+                    'keep-alive' if keep_alive else 'close')
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+def frame_shape(query):
+    """Return the (height, width) of a raw frame from the query string.
+
+    Returns None, for an encoded image, when neither is given.
+    """
+    args = parse_qs(query)
+    if 'width' not in args and 'height' not in args:
+        return None
+    try:
+        return int(args['height'][0]), int(args['width'][0])
+    except (KeyError, ValueError):
+        raise HttpError(400, 'raw frames need an integer width and height')
@@ -0,0 +1,219 @@
+"""Skin color model compiled into a lookup table.
+
+The model is a Bayes classifier P(skin | hue, saturation). The non-skin
+colors are the hue-saturation histogram of the non-skin pixels of a
+training image, the skin colors those of its skin pixels mixed with the
+hues and saturations of the default HSV range, so that skin tones the one
+image lacks are still found. The histograms are smoothed, and brightness
+is only required to be high enough for the hue to mean anything, so shaded
+or dim skin the range misses is found as well. The classifier is evaluated
+for every 24 bit BGR color into a table, so classifying a pixel is a single
+table lookup.
+
+The skin pixels are read from a mask of the training image. Without one
+they are labelled with the default HSV range, and the table cannot tell
+skin from background colors inside the range.
+"""
+
+import hashlib
+import os
+
+import cv2
+import numpy as np
+
+from config import app_config
+
+
+# Structuring element for the skin mask erosions and dilations.
+SKIN_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (11, 11))
+
+# Hue and saturation histogram bins, one per OpenCV 8 bit value.
+HUE_BINS = 180
+SATURATION_BINS = 256
+
+# Tables that have already been loaded, by the arguments of get_skin_lut.
+_tables = {}
+
+
+def label_skin(img, lower=app_config.SKIN_LOWER, upper=app_config.SKIN_UPPER):
+    """Label the skin pixels of a training image with a fixed HSV range.
+
+    This is the fallback when there is no mask of the training image.
+    """
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(
+        hsv, np.array(lower, np.uint8), np.array(upper, np.uint8))
+    mask = cv2.erode(mask, SKIN_KERNEL, iterations=1)
+    mask = cv2.dilate(mask, SKIN_KERNEL, iterations=1)
+    return mask > 0
+
+
+def _smooth(hist, sigma):
+    if sigma <= 0:
+        return hist
+
+    # Hue is circular, so wrap it around before smoothing.
+    pad = int(np.ceil(3 * sigma))
+    hist = np.pad(hist, ((pad, pad), (0, 0)), mode='wrap')
+    hist = cv2.GaussianBlur(hist, (0, 0), sigma,
+                            borderType=cv2.BORDER_CONSTANT)
+    return hist[pad:-pad]
+
+
+def _density(hsv, mask, sigma):
+    # Smoothed hue-saturation histogram of the masked pixels, summing to 1.
+    hist = cv2.calcHist([hsv], [0, 1], mask.astype(np.uint8),
+                        [HUE_BINS, SATURATION_BINS], [0, 180, 0, 256])
+    hist = _smooth(hist, sigma)
+    return hist / max(float(hist.sum()), 1)
+
+
+def _range_density(lower, upper, sigma):
+    # The hues and saturations of an HSV range, smoothed, summing to 1.
+    hist = np.zeros((HUE_BINS, SATURATION_BINS), np.float32)
+    hist[lower[0]:upper[0] + 1, lower[1]:upper[1] + 1] = 1
+    hist = _smooth(hist, sigma)
+    return hist / hist.sum()
+
+
+def train_skin_lut(img, mask=None, sigma=None, min_value=None,
+                   threshold=None):
+    """Build the skin lookup table from a BGR training image.
+
+    mask marks the skin pixels of the image and defaults to label_skin.
+    The density of the skin colors is the mean of those of the skin pixels
+    and of the default HSV range, whatever its value, so that skin tones
+    and lighting the one image lacks are still found. The non-skin density
+    is that of the other pixels. Histograms are smoothed by a Gaussian of
+    sigma bins, and colors darker than min_value are never skin. The
+    returned uint8 table has 2 ** 24 entries, 255 for skin colors and 0
+    otherwise, indexed by B + (G << 8) + (R << 16).
+    """
+    if mask is None:
+        mask = label_skin(img)
+    if sigma is None:
+        sigma = app_config.SKIN_LUT_SIGMA
+    if min_value is None:
+        min_value = app_config.SKIN_LUT_MIN_VALUE
+    if threshold is None:
+        threshold = app_config.SKIN_LUT_THRESHOLD
+
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    bright = hsv[..., 2] >= min_value
+    skin = (_density(hsv, mask & bright, sigma) + _range_density(
+        app_config.SKIN_LOWER, app_config.SKIN_UPPER, sigma)) / 2
+    other = _density(hsv, ~mask & bright, sigma)
+
+    # P(skin | hue, saturation) with equal class priors. A uniform density
+    # is added to the non-skin one, so that colors seen in neither class
+    # are not skin.
+    p = skin / (skin + other + 1 / skin.size)
+
+    # Evaluate the classifier for every 24 bit color, laid out as an image.
+    colors = np.arange(1 << 24, dtype='<u4').view(np.uint8)
+    colors = colors.reshape(4096, 4096, 4)[..., :3]
+    hsv = cv2.cvtColor(np.ascontiguousarray(colors), cv2.COLOR_BGR2HSV)
+    skin = (p[hsv[..., 0], hsv[..., 1]] >= threshold) & \
+        (hsv[..., 2] >= min_value)
+    return np.where(skin, 255, 0).astype(np.uint8).ravel()
+
+
+def save_skin_lut(lut, path):
+    # Write under a temporary name so that concurrent readers never see a
+    # partial file.
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        np.save(f, lut)
+    os.replace(tmp, path)
+
+
+def load_skin_lut(path):
+    """Memory-map a lookup table saved by save_skin_lut."""
+    return np.load(path, mmap_mode='r')
+
+
+def read_skin_mask(path, shape):
+    """Read the skin mask of the training image, None if there is none.
+
+    Nonzero pixels are skin.
+    """
+    if path is None or not os.path.exists(path):
+        return None
+    mask = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if mask is None or mask.shape != shape[:2]:
+        raise IOError('cannot read a {0}x{1} skin mask from {2}'.format(
+            shape[1], shape[0], path))
+    return mask > 0
+
+
+def skin_lut_path(training=None, mask=None):
+    """Path of the cached table of a training image and its mask.
+
+    The name is derived from the files and the training settings, so a
+    change to any of them trains a new table.
+    """
+    if training is None:
+        training = app_config.IMAGES['training']
+    if mask is None:
+        mask = app_config.SKIN_LUT_MASK
+
+    parts = []
+    for path in (training, mask):
+        if os.path.exists(path):
+            st = os.stat(path)
+            parts.append('{0}:{1}:{2}'.format(
+                os.path.abspath(path), st.st_mtime_ns, st.st_size))
+        else:
+            parts.append(os.path.abspath(path))
+    parts.extend([app_config.SKIN_LUT_SIGMA, app_config.SKIN_LUT_MIN_VALUE,
+                  app_config.SKIN_LUT_THRESHOLD])
+    key = ':'.join([str(p) for p in parts])
+    name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy'
+    return os.path.join(app_config.SKIN_LUT_DIR, name)
+
+
+def get_skin_lut(path=None, training=None, mask=None):
+    """Return the lookup table, training and saving it if needed.
+
+    The table is trained from the training image and its mask, see
+    read_skin_mask, both defaulting to the configured ones, and saved at
+    path. Without a path, or with True, it is cached under SKIN_LUT_DIR,
+    see skin_lut_path. Processes that train it at the same time each write
+    a complete file, but a process pool should still load it once before
+    starting its workers so that it is trained only once.
+    """
+    key = (path, training, mask)
+    if key in _tables:
+        return _tables[key]
+
+    if training is None:
+        training = app_config.IMAGES['training']
+    if path is None or path is True:
+        path = skin_lut_path(training, mask)
+    if mask is None:
+        mask = app_config.SKIN_LUT_MASK
+
+    if not os.path.exists(path):
+        img = cv2.imread(training, cv2.IMREAD_COLOR)
+        if img is None:
+            raise IOError('cannot read training image {0}'.format(training))
+        save_skin_lut(train_skin_lut(img, read_skin_mask(mask, img.shape)),
+                      path)
+    _tables[key] = load_skin_lut(path)
+    return _tables[key]
+
+
+def skin_lut_mask(img, lut, dst, bgra):
+    """Classify every pixel of a BGR image with the lookup table.
+
+    bgra is an (h, w, 4) uint8 scratch buffer used to pack the colors into
+    table indices without allocating.
+    """
+    cv2.cvtColor(img, cv2.COLOR_BGR2BGRA, bgra)
+    index = bgra.view('<u4')[..., 0]
+    np.bitwise_and(index, 0xFFFFFF, out=index)
+    np.take(lut, index, out=dst, mode='clip')
+    return dst
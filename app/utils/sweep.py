@@ -0,0 +1,237 @@
+"""Parameter sweeps scored against labeled fingertips.
+
+A sweep evaluates many settings of the skin HSV range and the binary
+threshold over a set of images whose fingertips are labeled. The settings
+of every image run through a StageGraph in an order that keeps shared
+prefixes together: the image is converted to HSV once, the skin is
+detected once per HSV range and reused by all the thresholds of that
+range. The images are spread over a process pool and the scores of the
+workers are summed.
+"""
+
+import json
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import cv2
+import numpy as np
+
+from app.utils.estimation import CLASSES
+from app.utils.graph import StageGraph
+from app.utils.image import readImage
+from app.utils.pipeline import make_context, shard
+
+
+# Names of the swept parameters, in the order of the prefix tree.
+PARAMETERS = ('lower', 'upper', 'threshold')
+
+# Estimates within this many pixels of the labeled tip count as correct.
+RADIUS = 10
+
+# Score of one setting over all the images: the fraction of labeled tips
+# estimated within the radius, the fraction estimated at all and the mean
+# distance of those estimated.
+Score = namedtuple('Score', ['params', 'pck', 'detected', 'mean_error'])
+
+
+def grid_points(lower, upper, thresholds):
+    """Return every combination of the given parameter values.
+
+    lower and upper are lists of three lists of H, S and V values.
+    """
+    return [
+        {'lower': lo, 'upper': up, 'threshold': t}
+        for lo, up, t in product(product(*lower), product(*upper), thresholds)
+    ]
+
+
+def random_points(count, lower, upper, thresholds, seed=None):
+    """Return count settings drawn uniformly from the ranges of the values.
+
+    Every H, S, V and threshold value is drawn between the smallest and
+    largest of the values given for it. Identical draws are kept once.
+    """
+    rng = np.random.RandomState(seed)
+
+    def draw(values):
+        return int(rng.randint(min(values), max(values) + 1))
+
+    points = OrderedDict()
+    for _ in range(count):
+        point = {
+            'lower': tuple(draw(v) for v in lower),
+            'upper': tuple(draw(v) for v in upper),
+            'threshold': draw(thresholds)
+        }
+        points.setdefault(_key(point), point)
+    return list(points.values())
+
+
+def _key(point):
+    return tuple(point[name] for name in PARAMETERS)
+
+
+def load_labels(path):
+    """Read the labeled fingertips of a set of images.
+
+    The file is in the JSON Lines format written by batch.py, one record
+    per image with the labeled tips as the estimates, so a corrected batch
+    output can be used as labels. Tips are in the coordinates of the
+    processing size. Returns the tips by file name as a dict of class name
+    to (x, y).
+    """
+    labels = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            labels[os.path.basename(record['file'])] = {
+                y: tuple(e['tip'])
+                for y, e in record.get('estimates', {}).items()
+            }
+    return labels
+
+
+def prefix_order(points):
+    """Return the setting indices ordered so shared prefixes are adjacent.
+
+    Settings are sorted by HSV range, then threshold, so every stage output
+    a StageGraph memoizes is reused by consecutive settings.
+    """
+    return sorted(range(len(points)), key=lambda i: (
+        tuple(points[i]['lower']), tuple(points[i]['upper']),
+        points[i]['threshold']))
+
+
+def sweep_image(img, tips, points, graph, order=None, radius=RADIUS):
+    """Run every setting on one image through a StageGraph.
+
+    tips are the labeled tips of the image. Returns the per setting counts
+    of correct and estimated tips and the sum of the distances of the
+    estimated ones.
+    """
+    if order is None:
+        order = prefix_order(points)
+    correct = np.zeros(len(points), np.int64)
+    estimated = np.zeros(len(points), np.int64)
+    errors = np.zeros(len(points))
+
+    labeled = [i for i, y in enumerate(CLASSES) if y in tips]
+    truth = np.array([tips[CLASSES[i]] for i in labeled], np.float64)
+
+    graph.load(img)
+    for i in order:
+        graph.set(**points[i])
+        # The labels are of one hand, score the largest.
+        hands = graph.run('observation')
+        if not hands or not labeled:
+            continue
+        found = hands[0].found[labeled]
+        distance = np.hypot(*(hands[0].tips[labeled] - truth)[found].T)
+        correct[i] = np.count_nonzero(distance <= radius)
+        estimated[i] = len(distance)
+        errors[i] = distance.sum()
+    return correct, estimated, errors
+
+
+def sweep_graph(params):
+    """Return the StageGraph the settings of an image are run through.
+
+    Every setting follows the last one, so only one output of every stage
+    is kept, and only the largest hand is estimated.
+    """
+    return StageGraph(make_context(params), {'hands': 1}, cache_size=1)
+
+
+# Settings and stage graph of a pool worker, set by init_worker.
+_worker_params = None
+_worker_points = None
+_worker_order = None
+_worker_radius = RADIUS
+_worker_graph = None
+
+
+def init_worker(params, points, radius=RADIUS):
+    """Prepare a pool worker to sweep the given settings."""
+    global _worker_params, _worker_points, _worker_order, _worker_radius
+    global _worker_graph
+    _worker_params = params
+    _worker_points = points
+    _worker_order = prefix_order(points)
+    _worker_radius = radius
+    _worker_graph = sweep_graph(params)
+    cv2.setNumThreads(1)
+
+
+def sweep_shard(items):
+    return sweep_items(items, _worker_params, _worker_points, _worker_graph,
+                       _worker_order, _worker_radius)
+
+
+def sweep_items(items, params, points, graph, order=None, radius=RADIUS):
+    """Sweep a list of (path, tips) items and return the summed counts."""
+    if order is None:
+        order = prefix_order(points)
+    totals = (np.zeros(len(points), np.int64),
+              np.zeros(len(points), np.int64), np.zeros(len(points)))
+    for path, tips in items:
+        img = readImage(path, params.get('size'), params.get('image_cache'))
+        if img is None:
+            continue
+        counts = sweep_image(img, tips, points, graph, order, radius)
+        for total, count in zip(totals, counts):
+            total += count
+    return totals
+
+
+def sweep(directory, labels, points, params, workers=1, shard_size=4,
+          radius=RADIUS):
+    """Score every setting over the labeled images of a directory.
+
+    params give the processing size and image cache as for batch.py. With
+    more than one worker (all cores when workers is None) the images are
+    sharded over a process pool. Returns one Score per setting, best first:
+    by the fraction of correct tips, then the fraction of detected tips,
+    then the mean error.
+    """
+    items = [
+        (os.path.join(directory, name), tips)
+        for name, tips in sorted(labels.items())
+        if os.path.exists(os.path.join(directory, name))
+    ]
+    total = sum(len(tips) for _, tips in items)
+    params = dict(params, pyramid=1)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        graph = sweep_graph(params)
+        results = [sweep_items(items, params, points, graph, None, radius)]
+    else:
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(params, points, radius)) as pool:
+            results = list(pool.map(sweep_shard, shard(items, shard_size)))
+
+    correct = np.zeros(len(points), np.int64)
+    estimated = np.zeros(len(points), np.int64)
+    errors = np.zeros(len(points))
+    for c, e, d in results:
+        correct += c
+        estimated += e
+        errors += d
+
+    scores = []
+    for i, point in enumerate(points):
+        scores.append(Score(
+            point,
+            float(correct[i] / total) if total else 0.0,
+            float(estimated[i] / total) if total else 0.0,
+            float(errors[i] / estimated[i]) if estimated[i]
+            else float('nan')))
+    scores.sort(key=lambda s: (-s.pck, -s.detected,
+                               np.inf if np.isnan(s.mean_error)
+                               else s.mean_error))
+    return scores
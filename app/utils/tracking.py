@@ -0,0 +1,174 @@
+"""Stateful estimation of a hand across the frames of a stream."""
+
+import cv2
+import numpy as np
+
+from app.utils.estimation import CLASSES, iterate_map
+from app.utils.geometry import finger_tips
+from app.utils.processing import find_palm
+from config import app_config
+
+
+# Offsets of a pixel's 3x3 neighbourhood, the contour of a blob runs along
+# its border or next to it.
+_NEIGHBOURS = np.array([(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+
+
+class HandTracker(object):
+    """Warm-starts the MAP estimation of every frame from the previous one.
+
+    On video the hand barely moves between frames, so the last frame's
+    estimates are used as the hypotheses and its palm is moved along with
+    them, by the mean movement of the finger tips, skipping the palm
+    search. When the warm-started match score drops below min_score,
+    or the previous frame did not estimate all five fingers, the frame is
+    estimated from scratch instead.
+    """
+
+    def __init__(self, min_score=None):
+        if min_score is None:
+            min_score = app_config.WARM_START_MIN_SCORE
+        self.min_score = min_score
+        self.reset()
+
+    def reset(self):
+        """Forget the previous frame so that the next one starts cold."""
+        self.amax = None
+        self.center = None
+        self.palm_center = None
+        self.palm_height = None
+        self.warm = False
+
+    def estimate(self, cnt, candidates):
+        """Estimate the finger tips of a frame.
+
+        Returns the estimates, the palm as returned by find_palm (without the
+        enclosing circle when warm-started) and the iteration diagnostics.
+        """
+        if self.amax is not None:
+            estimates, diagnostics = iterate_map(candidates, self.amax)
+            if (len(estimates) == 5 and
+                    diagnostics[-1].score >= self.min_score):
+                self.warm = True
+                self._move(estimates)
+                palm = (None, None, self.palm_center, self.palm_height)
+                return estimates, palm, diagnostics
+
+        self.warm = False
+        palm = find_palm(cnt)
+        hypotheses = finger_tips(palm[2], palm[3])
+        estimates, diagnostics = iterate_map(candidates, hypotheses)
+
+        if len(estimates) == 5:
+            self.center = np.array(palm[2], np.float64)
+            self.palm_center = palm[2]
+            self.palm_height = palm[3]
+            self._keep(estimates)
+        else:
+            self.reset()
+        return estimates, palm, diagnostics
+
+    def _keep(self, estimates):
+        self.amax = np.array([estimates[y][0] for y in CLASSES])
+
+    def _move(self, estimates):
+        # Shift the palm by the mean movement of the tips. The center is
+        # kept unrounded so that slow motion is not lost to rounding.
+        previous = self.amax
+        self._keep(estimates)
+        self.center += (self.amax - previous).mean(axis=0)
+        self.palm_center = (int(round(self.center[0])),
+                            int(round(self.center[1])))
+
+
+class RoiTracker(object):
+    """Restricts the preprocessing of a frame to where the hand last was.
+
+    The region is the bounding box of the enclosing circle of the previous
+    frame's hand contour grown by margin pixels on every side. The whole
+    frame is searched again every redetect_interval frames, and whenever
+    the hand is lost: when the region holds no contour, or when its contour
+    or the thresholded blob it outlines touches an edge of the region
+    inside the frame, as the region then cuts through the hand.
+    """
+
+    def __init__(self, margin=None, redetect_interval=None):
+        if margin is None:
+            margin = app_config.ROI_MARGIN
+        if redetect_interval is None:
+            redetect_interval = app_config.ROI_REDETECT_INTERVAL
+        self.margin = margin
+        self.redetect_interval = redetect_interval
+        self.reset()
+
+    def reset(self):
+        """Search the whole of the next frame."""
+        self.rect = None
+        self.frames = 0
+
+    def region(self, ctx):
+        """Return the context the stages should run on for this frame."""
+        if self.rect is None or self.frames >= self.redetect_interval:
+            self.reset()
+            return ctx
+        self.frames += 1
+        return ctx.roi(*self.rect)
+
+    def lost(self, ctx, work, cnt):
+        """Whether the hand was lost in the region work of ctx.
+
+        cnt is the contour found in the region, in frame coordinates. The
+        hand is lost when there is no contour, or when the contour or the
+        thresholded blob it outlines touches an edge of the region inside
+        the frame: the contour of a hand cut by the region may be a
+        fragment.
+        """
+        if cnt is None:
+            return True
+        if work is ctx:
+            return False
+
+        x0, y0 = work.offset
+        x1, y1 = x0 + work.width - 1, y0 + work.height - 1
+        edges = (x0 > 0, y0 > 0, x1 < ctx.width - 1, y1 < ctx.height - 1)
+
+        points = cnt.reshape(-1, 2)
+        if ((edges[0] and points[:, 0].min() <= x0 + 1) or
+                (edges[1] and points[:, 1].min() <= y0 + 1) or
+                (edges[2] and points[:, 0].max() >= x1 - 1) or
+                (edges[3] and points[:, 1].max() >= y1 - 1)):
+            return True
+
+        thresh = work.thresh
+        sides = [side for side, edge in zip(
+            (thresh[:, 0], thresh[0], thresh[:, -1], thresh[-1]), edges)
+            if edge and side.any()]
+        if not sides:
+            return False
+
+        # Only the thresholded blobs the contour runs along are the hand,
+        # other skin on the edges of the region does not matter.
+        labels = cv2.connectedComponents(thresh, connectivity=8)[1]
+        near = (points - (x0, y0))[:, np.newaxis, :] + _NEIGHBOURS
+        near = near.reshape(-1, 2)
+        hand = np.unique(labels[np.clip(near[:, 1], 0, work.height - 1),
+                                np.clip(near[:, 0], 0, work.width - 1)])
+        hand = hand[hand != 0]
+        sides = [labels[:, 0], labels[0], labels[:, -1], labels[-1]]
+        return any(edge and np.isin(side, hand).any()
+                   for side, edge in zip(sides, edges))
+
+    def update(self, ctx, cnt):
+        """Set the region of the next frame from this frame's contour."""
+        if cnt is None:
+            self.reset()
+            return
+
+        (cx, cy), radius = cv2.minEnclosingCircle(cnt)
+        x0 = max(int(np.floor(cx - radius)) - self.margin, 0)
+        y0 = max(int(np.floor(cy - radius)) - self.margin, 0)
+        x1 = min(int(np.ceil(cx + radius)) + 1 + self.margin,
+                 ctx.frame.shape[1])
+        y1 = min(int(np.ceil(cy + radius)) + 1 + self.margin,
+                 ctx.frame.shape[0])
+        self.rect = (x0, y0, x1 - x0, y1 - y0)
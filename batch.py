@@ -0,0 +1,117 @@
+"""Headless batch entry point.
+
+Runs the detection pipeline over a directory of images and writes the
+fingertip estimates of every image as JSON Lines.
+"""
+
+
+import argparse
+import json
+import sys
+import time
+
+from app.utils.metrics import metrics
+from app.utils.pipeline import list_images, load_params, process_files
+from config import app_config
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='directory of images to process')
+    parser.add_argument('-o', '--output', default='-',
+                        help='JSON Lines output file (default: stdout)')
+    parser.add_argument('-c', '--config',
+                        help='JSON file with lower, upper and threshold')
+    parser.add_argument('--lower', type=int, nargs=3, metavar=('H', 'S', 'V'),
+                        help='lower HSV bound of the skin range')
+    parser.add_argument('--upper', type=int, nargs=3, metavar=('H', 'S', 'V'),
+                        help='upper HSV bound of the skin range')
+    parser.add_argument('--threshold', type=int,
+                        help='binary threshold applied to the skin image')
+    parser.add_argument('--skin-lut', nargs='?', const=True, metavar='PATH',
+                        help='detect skin with a lookup table instead of the '
+                             'HSV range, trained from the training image if '
+                             'PATH does not exist (default: cached per '
+                             'training image)')
+    parser.add_argument('--skin-training', metavar='IMAGE',
+                        help='training image of the skin lookup table')
+    parser.add_argument('--skin-mask', metavar='MASK',
+                        help='mask of the skin pixels of the training image, '
+                             'nonzero for skin (default: label them with '
+                             'the HSV range)')
+    parser.add_argument('--track', action='store_true', default=None,
+                        help='treat the sorted images as consecutive video '
+                             'frames and warm-start each from the last')
+    parser.add_argument('--roi', action='store_true', default=None,
+                        help='treat the sorted images as consecutive video '
+                             'frames and only search around the last hand')
+    parser.add_argument('--size', type=int, nargs=2, metavar=('W', 'H'),
+                        help='resolution the images are processed at '
+                             '(default: {0} {1})'.format(
+                                 app_config.IMG_WIDTH, app_config.IMG_HEIHGT))
+    parser.add_argument('--pyramid', type=int, metavar='LEVELS',
+                        help='find the hand on the coarsest of LEVELS '
+                             'pyramid levels and refine the fingertip '
+                             'candidates up to --size')
+    parser.add_argument('--hands', type=int,
+                        help='estimate up to HANDS hands per image, '
+                             'largest first; tracking, --roi and --pyramid '
+                             'only apply to a single hand (default: '
+                             '{0})'.format(app_config.MAX_HANDS))
+    parser.add_argument('--image-cache', metavar='DIR',
+                        help='save the decoded, resized images to DIR and '
+                             'memory-map them on later runs')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='worker processes, 0 for one per core '
+                             '(default: 1)')
+    parser.add_argument('--shard-size', type=int, default=16,
+                        help='images handed to a worker at a time')
+    parser.add_argument('--max-inflight', type=int,
+                        help='shards queued or running at any time '
+                             '(default: twice the workers)')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='write per-stage timings and counters to PATH, '
+                             'in the Prometheus text format if PATH ends '
+                             'with .prom and as JSON otherwise')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = load_params(args.config, lower=args.lower, upper=args.upper,
+                         threshold=args.threshold, skin_lut=args.skin_lut,
+                         skin_training=args.skin_training,
+                         skin_mask=args.skin_mask,
+                         track=args.track, roi=args.roi, size=args.size,
+                         pyramid=args.pyramid, image_cache=args.image_cache,
+                         hands=args.hands)
+    paths = list_images(args.input)
+
+    metrics.enable(args.metrics is not None)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    start = time.perf_counter()
+    try:
+        records = process_files(paths, params, args.workers or None,
+                                args.shard_size, args.max_inflight)
+        for record in records:
+            out.write(json.dumps(record) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+
+    rate = len(paths) / elapsed if elapsed > 0 else 0.0
+    sys.stderr.write('Processed {0} images in {1:.2f}s ({2:.1f} images/sec)\n'
+                     .format(len(paths), elapsed, rate))
+
+    if args.metrics:
+        with open(args.metrics, 'w') as f:
+            if args.metrics.endswith('.prom'):
+                f.write(metrics.to_prometheus())
+            else:
+                f.write(metrics.to_json(indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Benchmark entry point.
+
+Times every pipeline stage on its own and end to end on synthetic inputs
+at several image sizes, hull point counts and mask noise levels, and
+compares the results with a saved baseline, failing when a stage got
+slower by more than the allowed tolerance.
+"""
+
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+import cv2
+import numpy as np
+
+from app.utils import jit
+from app.utils.draw import drawHandPalmarBounds
+from app.utils.estimation import iterate_map, iterate_map_batch
+from app.utils.geometry import DEFAULT_ANGLES, hand_geometry
+from app.utils.image import FrameContext
+from app.utils.models import HandPalmar
+from app.utils.pipeline import default_params, process_image
+from app.utils.processing import (
+    do_contours, do_edges, do_skin_detection, do_threshold, find_contour,
+    model_observation, model_projection, observe_hand,
+)
+from app.utils.skin import train_skin_lut
+from config import BASEDIR, app_config
+
+
+FINGERS = ('pinky', 'ring', 'middle', 'index', 'thumb')
+
+DEFAULT_BASELINE = os.path.join(BASEDIR, 'benchmark-baseline.json')
+
+
+def synthetic_hand(size, seed=0):
+    """Draw a noisy, skin colored hand following the palmar hand model."""
+    rng = np.random.RandomState(seed)
+    img = np.full((size, size, 3), (40, 60, 30), np.uint8)
+    skin = cv2.cvtColor(
+        np.uint8([[[10, 50, 220]]]), cv2.COLOR_HSV2BGR)[0, 0].tolist()
+
+    scale = size / 256
+    center = (int(128 * scale), int(150 * scale))
+    height = int(50 * scale)
+    geometry = hand_geometry(center, height)
+
+    p = geometry.palm
+    cv2.rectangle(img, tuple(int(v) for v in p.top_left),
+                  tuple(int(v) for v in p.bottom_right), skin, -1)
+    for base, tip in zip(geometry.bases, geometry.tips):
+        cv2.line(img, tuple(int(v) for v in base),
+                 tuple(int(v) for v in tip), skin, max(2, int(10 * scale)))
+
+    noise = rng.randint(-6, 7, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def synthetic_contour(size, points, seed=0):
+    """Return a dense, noisy contour whose convex hull has the given points.
+
+    The hull points are taken from the convex hull of the pixels of a disk,
+    which limits them to about 200 on a 1024 pixel image. The contour
+    between them is sampled every pixel and pushed a few pixels inwards so
+    that it stays inside the hull.
+    """
+    rng = np.random.RandomState(seed)
+    center = np.array([size / 2, size / 2])
+    radius = 0.45 * size
+    t = np.linspace(0, 2 * np.pi, 16 * size, endpoint=False)
+    disk = np.round(center + radius * np.stack(
+        [np.cos(t), np.sin(t)], axis=-1)).astype(np.int32)
+    hull = cv2.convexHull(disk).reshape(-1, 2)
+    index = np.linspace(0, len(hull), min(points, len(hull)), endpoint=False)
+    vertices = hull[index.astype(int)].astype(np.float64)
+
+    contour = []
+    for a, b in zip(vertices, np.roll(vertices, -1, axis=0)):
+        n = max(int(np.hypot(*(b - a))), 1)
+        edge = a + (np.arange(n)[:, np.newaxis] / n) * (b - a)
+        inwards = center - edge
+        inwards /= np.hypot(*inwards.T)[:, np.newaxis]
+        edge[1:] += inwards[1:] * rng.uniform(2, 4, (n - 1, 1))
+        contour.append(edge)
+
+    return np.round(np.concatenate(contour)).astype(np.int32).reshape(-1, 1, 2)
+
+
+def noisy_edges(size, noise, seed=0):
+    """Return the edges of a hand-sized disk on a background of specks.
+
+    noise is the fraction of pixels set at random before edge detection.
+    """
+    rng = np.random.RandomState(seed)
+    mask = np.zeros((size, size), np.uint8)
+    cv2.circle(mask, (size // 2, size // 2), size // 3, 255, -1)
+    mask[rng.rand(size, size) < noise] = 255
+    return cv2.Canny(mask, 100, 200)
+
+
+def find_contour_list(ctx):
+    """Largest contour as found before the external-only contour search."""
+    np.copyto(ctx.border, ctx.edges)
+    contours = cv2.findContours(
+        ctx.border, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE,
+        offset=ctx.offset)[-2]
+    if len(contours) == 0:
+        return None
+    return max(contours, key=cv2.contourArea)
+
+
+def backends():
+    """Names of the estimation backends that can run here."""
+    return ['numpy', 'jit'] if jit.available() else ['numpy']
+
+
+def use_backend(name):
+    app_config.USE_JIT = name == 'jit'
+
+
+def time_call(fn, repeat, number):
+    """Best time per call in seconds over repeat runs of number calls."""
+    fn()
+    return min(timeit.repeat(fn, repeat=repeat, number=number)) / number
+
+
+def run(sizes, hull_points, noise, repeat, number):
+    """Time every stage and return the results by benchmark name."""
+    params = default_params()
+    results = {}
+
+    def bench(name, fn):
+        results[name] = time_call(fn, repeat, number)
+        sys.stderr.write('{0:<40} {1:10.3f} ms\n'.format(
+            name, results[name] * 1000))
+
+    lut = train_skin_lut(synthetic_hand(256))
+    for size in sizes:
+        ctx = FrameContext(size, size)
+        ctx.load(synthetic_hand(size))
+        lower, upper = params['lower'], params['upper']
+        threshold = params['threshold']
+
+        bench('skin_detection@{0}'.format(size),
+              lambda: do_skin_detection(ctx, lower, upper))
+        bench('skin_detection_lut@{0}'.format(size),
+              lambda: do_skin_detection(ctx, lut=lut))
+        bench('threshold@{0}'.format(size),
+              lambda: do_threshold(ctx, threshold))
+        bench('edges@{0}'.format(size), lambda: do_edges(ctx))
+        bench('contours@{0}'.format(size), lambda: do_contours(ctx))
+
+        img = ctx.og.copy()
+        bench('end_to_end@{0}'.format(size),
+              lambda: process_image(img, params, ctx))
+
+        for fraction in noise:
+            ctx.edges[:] = noisy_edges(size, fraction)
+            suffix = '@{0}/{1:g}'.format(size, fraction)
+            bench('contours_list' + suffix, lambda: find_contour_list(ctx))
+            bench('contours_external' + suffix,
+                  lambda: find_contour(ctx, components=False))
+            bench('contours_components' + suffix,
+                  lambda: find_contour(ctx, components=True))
+
+    ctx = FrameContext(1024, 1024)
+    for points in hull_points:
+        cnt = synthetic_contour(1024, points)
+        bench('model_observation@{0}pts'.format(points),
+              lambda: model_observation(ctx, cnt))
+        bench('observe_hand@{0}pts'.format(points),
+              lambda: observe_hand(ctx, cnt))
+
+    center, height = (128, 150), 50
+    amax = hand_geometry(center, height).tips + 3
+    use_jit = app_config.USE_JIT
+    for backend in backends():
+        use_backend(backend)
+        for points in hull_points:
+            candidates = cv2.convexHull(
+                synthetic_contour(256, points)).reshape(-1, 2)
+            hypotheses = hand_geometry(center, height).tips
+            bench('iterate_map@{0}pts/{1}'.format(points, backend),
+                  lambda: iterate_map(candidates, hypotheses))
+        for hands in (2, 4, 8):
+            candidates = [
+                cv2.convexHull(synthetic_contour(256, 32, seed)).reshape(-1, 2)
+                for seed in range(hands)
+            ]
+            hypotheses = [hand_geometry(center, height).tips] * hands
+            bench('iterate_map_loop@{0}hands/{1}'.format(hands, backend),
+                  lambda: [iterate_map(c, h)
+                           for c, h in zip(candidates, hypotheses)])
+            bench('iterate_map_batch@{0}hands/{1}'.format(hands, backend),
+                  lambda: iterate_map_batch(candidates, hypotheses))
+        bench('hand_geometry/{0}'.format(backend),
+              lambda: hand_geometry(center, height))
+        bench('hand_geometry_amax/{0}'.format(backend),
+              lambda: hand_geometry(center, height, amax=amax))
+    app_config.USE_JIT = use_jit
+
+    ctx = FrameContext()
+    bench('model_projection',
+          lambda: model_projection(ctx, 'estimate', center, height, amax))
+    bench('drawHandPalmarBounds',
+          lambda: drawHandPalmarBounds(ctx.estimate, center, height))
+    bench('drawHandPalmarBounds_preview',
+          lambda: drawHandPalmarBounds(ctx.estimate, center, height,
+                                       preview=True))
+
+    def accessors():
+        model = HandPalmar(center, height)
+        for finger, theta in zip(FINGERS, DEFAULT_ANGLES):
+            getattr(model, finger)(theta)
+            getattr(model, finger + 'base')(theta)
+            getattr(model, finger + 'length')(theta)
+            getattr(model, finger + 'box')(theta)
+
+    bench('HandPalmar_accessors', accessors)
+    bench('HandPalmar_geometry',
+          lambda: HandPalmar(center, height).geometry())
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the benchmarks slower than baseline by more than tolerance %."""
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        if name not in baseline:
+            continue
+        change = (seconds / baseline[name] - 1) * 100
+        sys.stderr.write('{0:<40} {1:+8.1f}%\n'.format(name, change))
+        if change > tolerance:
+            regressions.append((name, change))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[256, 512, 1024],
+                        help='square image sizes of the image stages')
+    parser.add_argument('--hull-points', type=int, nargs='+',
+                        default=[16, 64, 160],
+                        help='convex hull point counts of model_observation')
+    parser.add_argument('--noise', type=float, nargs='+',
+                        default=[0, 0.002, 0.02],
+                        help='fractions of noise pixels in the contour '
+                             'search masks')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timing runs, the best one is kept')
+    parser.add_argument('--number', type=int, default=10,
+                        help='calls per timing run')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='baseline results file')
+    parser.add_argument('--save', action='store_true',
+                        help='write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=20,
+                        help='allowed slowdown in percent (default: 20)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args.sizes, args.hull_points, args.noise, args.repeat,
+                  args.number)
+
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        sys.stderr.write('No baseline at {0}, run with --save first\n'
+                         .format(args.baseline))
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.tolerance)
+    for name, change in regressions:
+        sys.stderr.write('REGRESSION {0}: {1:+.1f}%\n'.format(name, change))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -27,9 +27,38 @@ class Config(object):
         'apt-test-2': os.path.join(BASEDIR, 'app', 'files', 'hand-apt-2.jpg')
     }
 
+    # Decoded images kept in memory, and the directory decoded images are
+    # saved to and memory-mapped from (None to always decode).
+    IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+    IMAGE_CACHE_DIR = None
+
     IMG_WIDTH = 256
     IMG_HEIHGT = 256
 
+    # Default HSV range indicative of skin and binary threshold value.
+    SKIN_LOWER = (0, 23, 160)
+    SKIN_UPPER = (17, 80, 255)
+    THRESHOLD = 175
+
+    # Skin color lookup table trained from the training image, whose skin
+    # pixels are the nonzero pixels of SKIN_LUT_MASK or, without it, those in
+    # the default HSV range, and cached in SKIN_LUT_DIR. Hue-saturation
+    # histograms are smoothed by SKIN_LUT_SIGMA bins, and colors are skin
+    # when P(skin | hue, saturation) >= SKIN_LUT_THRESHOLD and their value is
+    # at least SKIN_LUT_MIN_VALUE.
+    SKIN_LUT_DIR = os.path.join(
+        os.environ.get('XDG_CACHE_HOME',
+                       os.path.join(os.path.expanduser('~'), '.cache')),
+        'hand-estimation', 'skin-lut')
+    SKIN_LUT_MASK = os.path.join(
+        BASEDIR, 'app', 'files', 'hand-train-mask.png')
+    SKIN_LUT_SIGMA = 2
+    SKIN_LUT_MIN_VALUE = 60
+    SKIN_LUT_THRESHOLD = 0.5
+
+    # Extensions of the image files picked up by the batch processor.
+    IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
     # Default angles (degrees) and palm to finger ratios.
     PINKY_DEFAULT_ANGLE = 119
     PINKY_DEFAULT_RATIO = 1.47
@@ -48,6 +77,58 @@ class Config(object):
 
     FINGER_WIDTH = 6
 
+    # Iterative MAP estimation stops once no finger hypothesis moves by more
+    # than MAP_TOLERANCE pixels or after MAP_MAX_ITERATIONS rounds.
+    MAP_MAX_ITERATIONS = 10
+    MAP_TOLERANCE = 0.5
+
+    # Match score below which a frame warm-started from the previous frame's
+    # estimates is estimated again from scratch.
+    WARM_START_MIN_SCORE = 0.25
+
+    # Region of interest tracking: pixels added around the enclosing circle
+    # of the last hand contour and number of frames after which the whole
+    # frame is searched again.
+    ROI_MARGIN = 16
+    ROI_REDETECT_INTERVAL = 30
+
+    # Coarse-to-fine mode: number of pyramid levels and radius in pixels of
+    # the window around every candidate that is refined at the finer levels.
+    PYRAMID_LEVELS = 3
+    PYRAMID_WINDOW = 6
+
+    # Use the Numba kernels of app.utils.jit when Numba is installed.
+    USE_JIT = True
+
+    # Interactive window refresh interval and the time the trackbars must
+    # rest before the stages are run again, both in milliseconds.
+    UI_REFRESH_MS = 30
+    UI_DEBOUNCE_MS = 50
+
+    # Outputs every stage of a StageGraph keeps, so that switching a
+    # parameter back to a recent value does not recompute anything.
+    STAGE_CACHE_SIZE = 8
+
+    # Hands estimated per frame: the MAX_HANDS largest contours whose area
+    # is at least HAND_MIN_AREA times that of the largest one.
+    MAX_HANDS = 1
+    HAND_MIN_AREA = 0.2
+
+    # Label the edges into connected components before tracing contours,
+    # faster on very noisy edges only.
+    CONTOUR_COMPONENTS = False
+
+    # Inference server: requests gathered into a batch, milliseconds the
+    # oldest request of a batch may wait for more, requests waiting at most
+    # before new ones are refused and largest accepted request body.
+    SERVER_MAX_BATCH = 8
+    SERVER_MAX_LATENCY = 5
+    SERVER_MAX_QUEUE = 256
+    SERVER_MAX_BODY = 16 * 1024 * 1024
+
+    # Number of most recent observations the metrics quantiles are over.
+    METRICS_WINDOW = 1024
+
     COLORS = {
         'black': (0, 0, 0),
         'white': (255, 255, 255),
@@ -1,16 +1,46 @@
 """Application entry point."""
 
 
+import sys
+
 import cv2
 import numpy as np
 
-from app.utils.image import (
-    getImage, setImage,
-)
+from app.utils.graph import BackgroundGraph, StageGraph
+from app.utils.image import FrameContext, getImage
 from app.utils.processing import *
 from config import app_config
 
 
+# Context buffer shown in every window that shows a processing result.
+RESULTS = (
+    ('Skin Detection', 'skin'),
+    ('Thresholding', 'thresh'),
+    ('Edge Detection', 'edges'),
+    ('Contours', 'contours'),
+    ('Hypothesis', 'hypothesis'),
+    ('MAP Estimate', 'estimate')
+)
+
+
+def trackbar_params():
+    """Read the skin range, threshold and hand count from the trackbars."""
+    return {
+        'lower': tuple(cv2.getTrackbarPos(name, 'Skin Detection')
+                       for name in ('LH', 'LS', 'LV')),
+        'upper': tuple(cv2.getTrackbarPos(name, 'Skin Detection')
+                       for name in ('UH', 'US', 'UV')),
+        'threshold': cv2.getTrackbarPos('Threshold', 'Thresholding'),
+        'hands': max(cv2.getTrackbarPos('Hands', 'Contours'), 1)
+    }
+
+
+def window_closed():
+    """Whether the user has closed any of the windows."""
+    return any(cv2.getWindowProperty(window, cv2.WND_PROP_VISIBLE) < 1
+               for window in app_config.WINDOWS)
+
+
 def main():
     """"""
 
@@ -29,43 +59,61 @@ def main():
     w = app_config.IMG_WIDTH
     h = app_config.IMG_HEIHGT
 
-    img = getImage('apt-test-2')
-    res = np.zeros((h, w, 3), np.uint8)
-    cv2.resize(img, (w, h), res)
+    ctx = FrameContext(w, h)
+    graph = StageGraph(ctx)
+    graph.load(getImage('apt-test-2'))
+    np.copyto(ctx.hypothesis, ctx.og)
+    np.copyto(ctx.estimate, ctx.og)
 
-    setImage('og', res)
-    setImage('hypothesis', res.copy())
-    setImage('estimate', res.copy())
+    lower = app_config.SKIN_LOWER
+    upper = app_config.SKIN_UPPER
 
-    cv2.createTrackbar('Threshold', 'Thresholding', 175, 255, lambda x: x)
+    # The stages run on a background thread, the trackbars only schedule
+    # them and the windows show the last finished result.
+    runner = BackgroundGraph(graph, 'render', [b for _, b in RESULTS])
 
-    cv2.createTrackbar('LH', 'Skin Detection', 0, 180, lambda x: x)
-    cv2.createTrackbar('LS', 'Skin Detection', 23, 255, lambda x: x)
-    cv2.createTrackbar('LV', 'Skin Detection', 160, 255, lambda x: x)
+    def changed(x):
+        # Not before all the trackbars have been created.
+        if runner.thread.is_alive():
+            runner.schedule(**trackbar_params())
 
-    cv2.createTrackbar('UH', 'Skin Detection', 17, 180, lambda x: x)
-    cv2.createTrackbar('US', 'Skin Detection', 80, 255, lambda x: x)
-    cv2.createTrackbar('UV', 'Skin Detection', 255, 255, lambda x: x)
+    cv2.createTrackbar('Threshold', 'Thresholding', app_config.THRESHOLD,
+                       255, changed)
 
-    while(1):
-        cv2.imshow('Input Image', getImage('og'))
-
-        do_skin_detection()
-        cv2.imshow('Skin Detection', getImage('skin'))
+    cv2.createTrackbar('LH', 'Skin Detection', lower[0], 180, changed)
+    cv2.createTrackbar('LS', 'Skin Detection', lower[1], 255, changed)
+    cv2.createTrackbar('LV', 'Skin Detection', lower[2], 255, changed)
 
-        do_threshold()
-        cv2.imshow('Thresholding', getImage('thresh'))
+    cv2.createTrackbar('UH', 'Skin Detection', upper[0], 180, changed)
+    cv2.createTrackbar('US', 'Skin Detection', upper[1], 255, changed)
+    cv2.createTrackbar('UV', 'Skin Detection', upper[2], 255, changed)
 
-        do_edges()
-        cv2.imshow('Edge Detection', getImage('edges'))
+    cv2.createTrackbar('Hands', 'Contours', app_config.MAX_HANDS, 4, changed)
 
-        cnt_max = do_contours()
-        model_observation(cnt_max)
-        cv2.imshow('Contours', getImage('contours'))
-        cv2.imshow('Hypothesis', getImage('hypothesis'))
-        cv2.imshow('MAP Estimate', getImage('estimate'))
+    cv2.imshow('Input Image', ctx.og)
+    runner.start()
+    changed(None)
 
-        if (cv2.waitKey(0) & 0xFF) in [27, 255]:
+    shown = None
+    reported = None
+    while(1):
+        latest = runner.latest()
+        if latest is not None and latest[0] != shown:
+            shown, buffers = latest
+            for window, key in RESULTS:
+                cv2.imshow(window, buffers[key])
+
+        # A failed stage leaves the windows as they were, say why.
+        error = runner.error
+        if error is not None and error is not reported:
+            sys.stderr.write('Stage failed: {0!r}\n'.format(error))
+        reported = error
+
+        # Quit on ESC or once a window is closed, which imshow would
+        # otherwise open again.
+        key = cv2.waitKey(app_config.UI_REFRESH_MS) & 0xFF
+        if key == 27 or window_closed():
+            runner.stop()
             cv2.destroyAllWindows()
             break
 
@@ -0,0 +1,88 @@
+"""Inference server entry point.
+
+Serves the fingertip estimates of posted frames over HTTP, on a TCP port or
+a Unix socket, see app.utils.server.
+"""
+
+
+import argparse
+import asyncio
+import sys
+
+from app.utils.pipeline import load_params
+from app.utils.server import InferenceServer
+from config import app_config
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='port to listen on (default: 8080)')
+    parser.add_argument('--unix', metavar='PATH',
+                        help='listen on a Unix socket instead of a port')
+    parser.add_argument('-c', '--config',
+                        help='JSON file with lower, upper and threshold')
+    parser.add_argument('--skin-lut', nargs='?', const=True, metavar='PATH',
+                        help='detect skin with a lookup table instead of the '
+                             'HSV range, trained from the training image if '
+                             'PATH does not exist (default: cached per '
+                             'training image)')
+    parser.add_argument('--skin-training', metavar='IMAGE',
+                        help='training image of the skin lookup table')
+    parser.add_argument('--skin-mask', metavar='MASK',
+                        help='mask of the skin pixels of the training image, '
+                             'nonzero for skin (default: label them with '
+                             'the HSV range)')
+    parser.add_argument('--size', type=int, nargs=2, metavar=('W', 'H'),
+                        help='resolution the frames are processed at '
+                             '(default: {0} {1})'.format(
+                                 app_config.IMG_WIDTH, app_config.IMG_HEIHGT))
+    parser.add_argument('--pyramid', type=int, metavar='LEVELS',
+                        help='find the hand on the coarsest of LEVELS '
+                             'pyramid levels')
+    parser.add_argument('--hands', type=int,
+                        help='estimate up to HANDS hands per frame, '
+                             'largest first; --pyramid only applies to a '
+                             'single hand (default: {0})'.format(
+                                 app_config.MAX_HANDS))
+    parser.add_argument('-j', '--workers', type=int, default=0,
+                        help='worker processes, 0 for one per core '
+                             '(default: 0)')
+    parser.add_argument('--max-batch', type=int,
+                        help='frames run together by a worker (default: '
+                             '{0})'.format(app_config.SERVER_MAX_BATCH))
+    parser.add_argument('--max-latency', type=float, metavar='MS',
+                        help='milliseconds a frame may wait for its batch '
+                             'to fill (default: {0})'.format(
+                                 app_config.SERVER_MAX_LATENCY))
+    parser.add_argument('--max-queue', type=int,
+                        help='frames waiting before new ones are refused '
+                             'with 503 (default: {0})'.format(
+                                 app_config.SERVER_MAX_QUEUE))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = load_params(args.config, skin_lut=args.skin_lut,
+                         skin_training=args.skin_training,
+                         skin_mask=args.skin_mask, size=args.size,
+                         pyramid=args.pyramid, hands=args.hands)
+    max_latency = None
+    if args.max_latency is not None:
+        max_latency = args.max_latency / 1000
+
+    server = InferenceServer(params, args.workers or None, args.max_batch,
+                             max_latency, args.max_queue)
+    sys.stderr.write('Serving on {0}\n'.format(
+        args.unix or '{0}:{1}'.format(args.host, args.port)))
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Parameter sweep entry point.
+
+Scores a grid or a random search of the skin HSV range and the threshold
+against the labeled fingertips of a set of images and writes the settings
+best first as JSON Lines.
+"""
+
+
+import argparse
+import json
+import sys
+import time
+
+from app.utils.pipeline import load_params
+from app.utils.sweep import (
+    RADIUS, grid_points, load_labels, random_points, sweep,
+)
+from config import app_config
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', help='directory of the labeled images')
+    parser.add_argument('labels',
+                        help='JSON Lines file of the labeled tips, in the '
+                             'format of the batch.py output')
+    parser.add_argument('-o', '--output', default='-',
+                        help='JSON Lines output file (default: stdout)')
+    lower, upper = app_config.SKIN_LOWER, app_config.SKIN_UPPER
+    for name, default in zip(('lh', 'ls', 'lv', 'uh', 'us', 'uv'),
+                             lower + upper):
+        parser.add_argument('--' + name, type=int, nargs='+',
+                            default=[default],
+                            help='values of the {0} bound of the skin range '
+                                 '(default: {1})'.format(name.upper(),
+                                                         default))
+    parser.add_argument('--threshold', type=int, nargs='+',
+                        default=[app_config.THRESHOLD],
+                        help='values of the binary threshold (default: '
+                             '{0})'.format(app_config.THRESHOLD))
+    parser.add_argument('--random', type=int, metavar='N',
+                        help='draw N settings between the smallest and '
+                             'largest of every value list instead of the '
+                             'grid of all their combinations')
+    parser.add_argument('--seed', type=int, help='seed of the random search')
+    parser.add_argument('--radius', type=float, default=RADIUS,
+                        help='pixels within which an estimate is correct '
+                             '(default: {0})'.format(RADIUS))
+    parser.add_argument('--size', type=int, nargs=2, metavar=('W', 'H'),
+                        help='resolution the images are processed and '
+                             'labeled at (default: {0} {1})'.format(
+                                 app_config.IMG_WIDTH, app_config.IMG_HEIHGT))
+    parser.add_argument('--image-cache', metavar='DIR',
+                        help='save the decoded, resized images to DIR and '
+                             'memory-map them on later runs')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='worker processes, 0 for one per core '
+                             '(default: 1)')
+    parser.add_argument('--shard-size', type=int, default=4,
+                        help='images handed to a worker at a time')
+    parser.add_argument('--top', type=int,
+                        help='only write the TOP best settings')
+    parser.add_argument('--best-config', metavar='PATH',
+                        help='write the best setting to PATH as a config '
+                             'file for batch.py -c')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = load_params(size=args.size, image_cache=args.image_cache)
+    labels = load_labels(args.labels)
+
+    lower = [args.lh, args.ls, args.lv]
+    upper = [args.uh, args.us, args.uv]
+    if args.random:
+        points = random_points(args.random, lower, upper, args.threshold,
+                               args.seed)
+    else:
+        points = grid_points(lower, upper, args.threshold)
+
+    start = time.perf_counter()
+    scores = sweep(args.input, labels, points, params, args.workers or None,
+                   args.shard_size, args.radius)
+    elapsed = time.perf_counter() - start
+    sys.stderr.write('Scored {0} settings on {1} images in {2:.2f}s\n'.format(
+        len(points), len(labels), elapsed))
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for score in scores[:args.top]:
+            record = dict(score.params, pck=score.pck,
+                          detected=score.detected,
+                          mean_error=None if score.detected == 0
+                          else score.mean_error)
+            out.write(json.dumps(record) + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if args.best_config and scores:
+        best = scores[0].params
+        with open(args.best_config, 'w') as f:
+            json.dump({
+                'lower': list(best['lower']),
+                'upper': list(best['upper']),
+                'threshold': best['threshold']
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
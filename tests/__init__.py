@@ -0,0 +1,15 @@
+"""Tests, run with python -m pytest from the repository root."""
+
+import numpy as np
+
+
+def same(a, b):
+    """Whether two results are equal, down to the array dtypes."""
+    if isinstance(a, dict):
+        return (isinstance(b, dict) and sorted(a) == sorted(b) and
+                all(same(a[k], b[k]) for k in a))
+    if isinstance(a, (tuple, list)):
+        return (isinstance(b, (tuple, list)) and len(a) == len(b) and
+                all(same(x, y) for x, y in zip(a, b)))
+    a, b = np.asarray(a), np.asarray(b)
+    return a.dtype == b.dtype and np.array_equal(a, b)
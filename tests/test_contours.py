@@ -0,0 +1,29 @@
+"""Telling the contours of separate hands from pieces of one hand."""
+
+from app.utils.image import FrameContext
+from app.utils.processing import do_edges, find_contours
+
+
+def contours(*blobs):
+    """The contours of the given thresholded boxes, in a 200x120 frame."""
+    ctx = FrameContext(200, 120)
+    for x0, y0, x1, y1 in blobs:
+        ctx.thresh[y0:y1, x0:x1] = 255
+    do_edges(ctx)
+    return find_contours(ctx, 3, 0)
+
+
+def test_hands_with_overlapping_boxes_are_kept():
+    # An arm reaching under a second hand, without touching it.
+    hand = [(20, 20, 60, 100), (60, 80, 120, 100)]
+    assert len(contours(*hand + [(80, 20, 130, 70)])) == 2
+
+
+def test_skin_inside_a_hand_is_a_piece_of_it():
+    # A finger tip cut off in the gap between two fingers.
+    hand = [(20, 60, 100, 100), (20, 20, 40, 60), (80, 20, 100, 60)]
+    assert len(contours(*hand + [(55, 24, 65, 34)])) == 1
+
+
+def test_separate_hands_are_kept():
+    assert len(contours((20, 20, 60, 100), (120, 20, 160, 100))) == 2
@@ -0,0 +1,62 @@
+"""The NumPy and Numba backends give identical estimates."""
+
+import numpy as np
+import pytest
+
+from app.utils import jit
+from app.utils.estimation import iterate_map, iterate_map_batch
+from app.utils.geometry import hand_geometry
+from config import app_config
+from tests import same
+
+
+pytestmark = pytest.mark.skipif(not jit.available(),
+                                reason='Numba is not installed')
+
+
+def random_case(rng):
+    """A hand, its hypotheses and noisy candidates, and a batch of three."""
+    center = tuple(rng.randint(32, 224, 2))
+    height = int(rng.randint(8, 80))
+    hypotheses = hand_geometry(center, height).tips
+    candidates = np.concatenate([
+        hypotheses + rng.randint(-20, 21, hypotheses.shape),
+        rng.randint(0, 256, (rng.randint(0, 40), 2))
+    ])[:rng.randint(1, 46)]
+    amax = candidates[rng.randint(0, len(candidates), 5)]
+    hands = [candidates, candidates[::2] + 7,
+             candidates[::-1][:max(len(candidates) // 2, 1)] - 5]
+    batch = [hypotheses, hypotheses + 7, hypotheses - 5]
+    return center, height, hypotheses, candidates, amax, hands, batch
+
+
+def estimate(case):
+    center, height, hypotheses, candidates, amax, hands, batch = case
+    return (iterate_map(candidates, hypotheses),
+            iterate_map_batch(hands, batch),
+            hand_geometry(center, height),
+            hand_geometry(center, height, amax=amax))
+
+
+def test_backends_agree(monkeypatch):
+    rng = np.random.RandomState(0)
+    mismatches = []
+    for i in range(1000):
+        case = random_case(rng)
+        monkeypatch.setattr(app_config, 'USE_JIT', False)
+        numpy_result = estimate(case)
+        monkeypatch.setattr(app_config, 'USE_JIT', True)
+        jit_result = estimate(case)
+        if not same(numpy_result, jit_result):
+            mismatches.append(i)
+    assert mismatches == []
+
+
+def test_batch_equals_single_hands(monkeypatch):
+    rng = np.random.RandomState(1)
+    for use_jit in (False, True):
+        monkeypatch.setattr(app_config, 'USE_JIT', use_jit)
+        for _ in range(200):
+            _, _, _, _, _, hands, batch = random_case(rng)
+            single = [iterate_map(c, h) for c, h in zip(hands, batch)]
+            assert same(iterate_map_batch(hands, batch), single)
@@ -0,0 +1,82 @@
+"""Hand models evaluated concurrently on a thread pool."""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.utils.geometry import DEFAULT_ANGLES
+from app.utils.models import HandPalmar, HandSide
+from tests import same
+
+
+FINGERS = ('pinky', 'ring', 'middle', 'index', 'thumb')
+
+# The finger and thumb angles drawHandSideBounds uses.
+SIDE_FINGER = -87 * np.pi / 180
+SIDE_THUMB = -45 * np.pi / 180
+
+
+def model_specs(count, seed=0):
+    """Random HandPalmar and HandSide specs, with and without estimates."""
+    rng = np.random.RandomState(seed)
+    specs = []
+    for i in range(count):
+        center = tuple(int(v) for v in rng.randint(32, 224, 2))
+        height = int(rng.randint(8, 80))
+        amax = rng.randint(0, 256, (5, 2)) if i % 3 == 1 else None
+        angles = DEFAULT_ANGLES if i % 2 else rng.uniform(-np.pi, 0, 5)
+        specs.append((i % 3 == 2, center, height, amax, angles))
+    return specs
+
+
+def build(spec):
+    side, center, height, amax, _ = spec
+    if side:
+        return HandSide(center, height)
+    return HandPalmar(center, height, amax)
+
+
+def evaluate(model, spec):
+    """Every accessor of the model and, for HandPalmar, its geometry."""
+    if isinstance(model, HandSide):
+        return [model.center, model.top_left(), model.bottom_right(),
+                model.finger(SIDE_FINGER), model.fingerbase(SIDE_FINGER),
+                model.fingerlength(SIDE_FINGER),
+                model.fingerbox(SIDE_FINGER), model.thumb(SIDE_THUMB),
+                model.thumbbase(SIDE_THUMB), model.thumblength(SIDE_THUMB),
+                model.thumbbox(SIDE_THUMB)]
+    return [model.center, model.top_left(), model.bottom_right(),
+            tuple(model.geometry()[1:])] + [
+        getattr(model, finger + suffix)(theta)
+        for finger, theta in zip(FINGERS, spec[4])
+        for suffix in ('', 'base', 'length', 'box')
+    ]
+
+
+def test_models_do_not_share_state():
+    a = HandPalmar((50, 60), 40)
+    center = tuple(a.center)
+    HandPalmar((200, 10), 20)
+    HandSide((90, 90), 30)
+    assert tuple(a.center) == center
+
+
+def test_models_on_a_thread_pool():
+    specs = model_specs(2000)
+
+    # All the models are alive at once, then evaluated serially.
+    built = [build(spec) for spec in specs]
+    serial = [evaluate(model, spec) for model, spec in zip(built, specs)]
+
+    # Half the models are shared across the threads, the other half are
+    # built anew on them in between.
+    def run(i):
+        model = built[i] if i % 2 else build(specs[i])
+        return evaluate(model, specs[i])
+
+    with ThreadPoolExecutor(16) as pool:
+        concurrent = list(pool.map(run, range(len(specs))))
+
+    mismatches = [i for i, (a, b) in enumerate(zip(serial, concurrent))
+                  if not same(a, b)]
+    assert mismatches == []
@@ -0,0 +1,55 @@
+"""Candidate refinement against thresholding the whole frame."""
+
+import numpy as np
+import pytest
+
+from app.utils.image import FrameContext
+from app.utils.pipeline import load_params
+from app.utils.processing import do_skin_detection, do_threshold
+from app.utils.pyramid import PyramidContext, refine_candidates
+from app.utils.skin import train_skin_lut
+from benchmark import synthetic_hand
+
+
+RADIUS = 6
+CENTER = (128, 150)
+
+
+def furthest(thresh, candidates):
+    """Refine the candidates on a thresholded whole frame."""
+    refined = candidates.copy()
+    for i, (x, y) in enumerate(candidates):
+        x0, y0 = max(x - RADIUS, 0), max(y - RADIUS, 0)
+        ys, xs = np.nonzero(thresh[y0:y + RADIUS + 1, x0:x + RADIUS + 1])
+        if len(xs):
+            d = (xs + x0 - CENTER[0]) ** 2 + (ys + y0 - CENTER[1]) ** 2
+            j = np.argmax(d)
+            refined[i] = (xs[j] + x0, ys[j] + y0)
+    return refined
+
+
+@pytest.mark.parametrize('use_lut', [False, True])
+def test_windows_are_thresholded_as_the_whole_frame(use_lut):
+    img = synthetic_hand(256)
+    lut = train_skin_lut(img) if use_lut else None
+    params = load_params()
+    ctx = FrameContext(256, 256)
+    ctx.load(img)
+    do_skin_detection(ctx, params['lower'], params['upper'], lut)
+    do_threshold(ctx, params['threshold'])
+
+    # Candidates all over the frame, its corners and edges included.
+    rng = np.random.RandomState(0)
+    candidates = np.concatenate([
+        rng.randint(0, 256, (200, 2)),
+        [[0, 0], [255, 255], [0, 255], [255, 0], [3, 128], [128, 252]],
+    ])
+    expected = furthest(ctx.thresh, candidates)
+
+    window = FrameContext(256, 256)
+    window.load(img)
+    pyramid = PyramidContext(256, 256, 1)
+    for pyr in (None, pyramid, pyramid):
+        refined = refine_candidates(
+            window, candidates, CENTER, params, lut, RADIUS, pyr)
+        assert np.array_equal(refined, expected)
@@ -0,0 +1,57 @@
+"""The trained skin lookup table against the HSV range it extends."""
+
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.skin import get_skin_lut, skin_lut_path, train_skin_lut
+from config import app_config
+
+
+def bgr(hsv):
+    return cv2.cvtColor(np.uint8([[hsv]]), cv2.COLOR_HSV2BGR)[0, 0]
+
+
+def lookup(lut, color):
+    b, g, r = [int(v) for v in color]
+    return lut[b + (g << 8) + (r << 16)]
+
+
+@pytest.fixture(scope='module')
+def training():
+    """A skin colored square on a green background and its mask."""
+    img = np.full((128, 128, 3), (40, 60, 30), np.uint8)
+    img[32:96, 32:96] = bgr((10, 50, 220))
+    mask = np.zeros((128, 128), bool)
+    mask[32:96, 32:96] = True
+    return img, mask
+
+
+def test_table_covers_the_range_at_any_brightness(training):
+    lut = train_skin_lut(training[0])
+    lower, upper = app_config.SKIN_LOWER, app_config.SKIN_UPPER
+    for h in range(lower[0] + 2, upper[0] - 1, 3):
+        for s in range(lower[1] + 4, upper[1] - 3, 10):
+            # Bright enough for the range, and shaded below it.
+            for v in (220, 100):
+                assert lookup(lut, bgr((h, s, v))) == 255, (h, s, v)
+
+
+def test_table_rejects_background_and_dark_colors(training):
+    img, mask = training
+    lut = train_skin_lut(img, mask)
+    assert lookup(lut, (40, 60, 30)) == 0
+    assert lookup(lut, bgr((10, 50, app_config.SKIN_LUT_MIN_VALUE - 1))) == 0
+    assert lookup(lut, bgr((60, 200, 200))) == 0
+
+
+def test_table_is_cached_per_training_image(training, tmp_path,
+                                            monkeypatch):
+    monkeypatch.setattr(app_config, 'SKIN_LUT_DIR', str(tmp_path / 'lut'))
+    path = str(tmp_path / 'train.png')
+    cv2.imwrite(path, training[0])
+
+    lut = get_skin_lut(training=path, mask=str(tmp_path / 'none.png'))
+    cached = skin_lut_path(path, str(tmp_path / 'none.png'))
+    assert cached.startswith(str(tmp_path / 'lut'))
+    assert np.array_equal(np.load(cached), lut)
@@ -0,0 +1,57 @@
+"""When the region of interest counts the hand as lost."""
+
+import cv2
+import numpy as np
+
+from app.utils.image import FrameContext
+from app.utils.tracking import RoiTracker
+
+
+def outline(mask, x0, y0):
+    """Outer contour of a region mask, in frame coordinates."""
+    contours = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL,
+                                cv2.CHAIN_APPROX_NONE, offset=(x0, y0))[-2]
+    return max(contours, key=cv2.contourArea)
+
+
+def region(hand, stray=None):
+    """A 50x50 region of a 100x100 frame with the given blobs thresholded."""
+    ctx = FrameContext(100, 100)
+    for x0, y0, x1, y1 in [hand] + ([stray] if stray else []):
+        ctx.thresh[y0:y1, x0:x1] = 255
+    work = ctx.roi(20, 20, 50, 50)
+    return ctx, work
+
+
+def test_no_contour_is_lost():
+    ctx, work = region((40, 40, 50, 50))
+    assert RoiTracker().lost(ctx, work, None)
+
+
+def test_hand_inside_the_region_is_kept():
+    ctx, work = region((35, 35, 55, 55))
+    cnt = outline(work.thresh, 20, 20)
+    assert not RoiTracker().lost(ctx, work, cnt)
+
+
+def test_other_skin_on_the_edge_is_ignored():
+    ctx, work = region((35, 35, 55, 55), stray=(64, 22, 74, 32))
+    cnt = outline(work.thresh, 20, 20)
+    assert not RoiTracker().lost(ctx, work, cnt)
+
+
+def test_hand_cut_by_the_region_is_lost():
+    ctx, work = region((35, 35, 90, 55))
+    mask = work.thresh.copy()
+    # Only a fragment of the outline, away from the region's edges.
+    mask[:, 30:] = 0
+    cnt = outline(mask, 20, 20)
+    assert RoiTracker().lost(ctx, work, cnt)
+
+
+def test_frame_edges_do_not_cut_the_hand():
+    ctx = FrameContext(100, 100)
+    ctx.thresh[60:100, 40:60] = 255
+    work = ctx.roi(20, 50, 60, 50)
+    cnt = outline(work.thresh, 20, 50)
+    assert not RoiTracker().lost(ctx, work, cnt)